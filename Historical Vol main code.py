@@ -1,18 +1,49 @@
 import ccxt
-import sys
+import os
 import math
+import hashlib
+import pickle
+import json
+import asyncio
+from time import perf_counter_ns
 from datetime import datetime, timedelta
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy.stats import norm
 from scipy.optimize import newton
+from scipy.special import ndtr
 from matplotlib.lines import Line2D
 from matplotlib.dates import DayLocator, DateFormatter
 from tabulate import tabulate
 
 
 binance = ccxt.binance()
+FileSourceCache = {}
+PriceCache = {} #FetchData results keyed by its arguments, filled with preloaded prices in workers
+HistVolTableCache = {} #rolling vol tables from HistoricalVolTable, built once per process
+FileHashCache = {} #content hashes keyed by (path, size, mtime) so unchanged files are only read once
+ChainIndexCache = {} #memory mapped chain indexes from ChainIndex keyed by (year, month, DatasetFormat)
+#How each formatted dataset column is stored in the columnar format
+OptionColumnTypes = {"exchange": "category", "symbol": "category", "timestamp": "time", "local_timestamp": "time", "type": "category",
+                     "strike_price": np.float64, "expiration": "time", "open_interest": np.float32, "last_price": np.float64,
+                     "bid_price": np.float64, "bid_amount": np.float32, "bid_iv": np.float64, "ask_price": np.float64,
+                     "ask_amount": np.float32, "ask_iv": np.float64, "mark_price": np.float64, "mark_iv": np.float64,
+                     "underlying_index": "category", "underlying_price": np.float64, "delta": np.float64,
+                     "gamma": np.float32, "vega": np.float32, "theta": np.float32, "rho": np.float32}
+#One row per trade, bought and sold options in the order they were placed
+#side is +1 bought and -1 sold, size is in contracts, marketVol is in percent, hedgeDelta and hedgeCash come from HedgeLedger and profit from SettleLedger
+TradeLedgerType = np.dtype([("time", np.int64), ("isCall", np.bool_), ("side", np.int8), ("size", np.float64), ("expirationDay", np.int16), ("strike", np.float64),
+                            ("price", np.float64), ("delta", np.float64), ("marketVol", np.float64), ("myVol", np.float64),
+                            ("hedgeDelta", np.float64), ("hedgeCash", np.float64), ("profit", np.float64)])
+#Kinds of event in a Replay stream, events at the same time are handled in this order
+EventBar, EventExpiry, EventMonth, EventQuote = 0, 1, 2, 3
+#The quote fields Replay hands to the quote callback, in this order
+ReplayColumns = ["timestamp", "type", "strike_price", "expirationDay", "yearFraction", "delta", "bid_price", "ask_price", "underlying_price", "bid_iv", "ask_iv", "mark_iv"]
+#The columns the trading functions read
+PricingColumns = ["timestamp", "type", "strike_price", "expirationDay", "yearFraction", "delta", "bid_price", "ask_price", "underlying_price",
+                  "bid_amount", "ask_amount", "open_interest", "bid_iv", "ask_iv", "mark_iv"]
 
 #FUNCTIONS
 
@@ -26,15 +57,142 @@ def FetchData(symbol, timeframe, points, start):
     """
     #convert start_date to timestamp
 
+    if (symbol, timeframe, points, start) in PriceCache:
+        return PriceCache[(symbol, timeframe, points, start)].copy()
     since =  int(datetime.timestamp(datetime.strptime(start, "%Y-%m-%d")) * 1000)
     #fetch data
 
-    bars = binance.fetch_ohlcv(symbol, timeframe = timeframe, since = since, limit = points)
+    if BarStoreDir is None:
+        bars = BarSource(symbol, timeframe, since, points)
+    else:
+        #serve the slice from the local bar store, only going to BarSource for bars it doesn't have yet
+        bars, ranges = LoadBars(symbol, timeframe)
+        missing = MissingRanges(ranges, since, since + points * TimeframeMs(timeframe))
+        if len(missing) > 0:
+            bars, ranges = StoreBars(symbol, timeframe, bars, ranges, missing)
+        first = np.searchsorted(bars[:, 0], since)
+        bars = np.array(bars[first:first + points])
     df = pd.DataFrame(bars, columns=["Timestamp", "Open", "High", "Low", "Close", "Volume"])
-    df["Timestamp"] = pd.to_datetime(df["Timestamp"], unit= "ms")
+    df["Timestamp"] = pd.to_datetime(df["Timestamp"].astype(np.int64), unit= "ms")
 
     return df
 
+def TimeframeMs(timeframe):
+    #"5m", "2h", "1d" etc. to milliseconds
+    units = {"m": 60_000, "h": 3_600_000, "d": 86_400_000}
+    return int(timeframe[:-1]) * units[timeframe[-1]]
+
+def BinanceSource(symbol, timeframe, since, limit):
+    #Live bars from Binance, [timestamp ms, open, high, low, close, volume] per bar
+    #Binance gives at most 1000 bars a request, so longer asks are fetched 1000 at a time
+    bars = []
+    while len(bars) < limit:
+        fetched = binance.fetch_ohlcv(symbol, timeframe = timeframe, since = since, limit = min(1000, limit - len(bars)))
+        if len(fetched) == 0:
+            break
+        bars.extend(fetched)
+        since = int(fetched[-1][0]) + TimeframeMs(timeframe)
+
+    return bars[:limit]
+
+def FileSource(symbol, timeframe, since, limit):
+    #Stand-in for BinanceSource that reads bars from CSV files in BarFileDir so nothing touches the network
+    bars = FileSourceBars(symbol, timeframe)
+    first = np.searchsorted(bars[:, 0], since)
+
+    return bars[first:first + limit].tolist()
+
+def FileSourceBars(symbol, timeframe):
+    #Files are named like "BTC_USDT-5m.csv" with Timestamp (ms), Open, High, Low, Close, Volume columns
+    #If there's no file for the timeframe the bars are built from the finest file there is for the symbol
+    key = (symbol, timeframe)
+    if key not in FileSourceCache:
+        name = symbol.replace("/", "_")
+        path = os.path.join(BarFileDir, f"{name}-{timeframe}.csv")
+        if os.path.exists(path):
+            FileSourceCache[key] = pd.read_csv(path).to_numpy(dtype=float)
+        else:
+            finer = [f[len(name)+1:-4] for f in os.listdir(BarFileDir) if f.startswith(name + "-") and f.endswith(".csv")]
+            finer = [tf for tf in finer if TimeframeMs(timeframe) % TimeframeMs(tf) == 0]
+            if len(finer) == 0:
+                raise FileNotFoundError(f"No bar file in {BarFileDir} for {symbol} {timeframe}")
+            FileSourceCache[key] = ResampleBars(FileSourceBars(symbol, min(finer, key=TimeframeMs)), timeframe)
+
+    return FileSourceCache[key]
+
+def ResampleBars(bars, timeframe):
+    #Aggregates an (n, 6) bar array into a coarser timeframe aligned to UTC like Binance's bars
+    bucket = bars[:, 0] // TimeframeMs(timeframe) * TimeframeMs(timeframe)
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(bars)] - 1
+    return np.column_stack([bucket[starts], bars[starts, 1], np.maximum.reduceat(bars[:, 2], starts),
+                            np.minimum.reduceat(bars[:, 3], starts), bars[ends, 4], np.add.reduceat(bars[:, 5], starts)])
+
+def BarStorePath(symbol, timeframe):
+    return os.path.join(BarStoreDir, f"{symbol.replace('/', '_')}-{timeframe}")
+
+def LoadBars(symbol, timeframe):
+    #Stored bars as a memory mapped (n, 6) array sorted by timestamp, plus the [start, end) ms ranges already fetched
+    path = BarStorePath(symbol, timeframe)
+    if not os.path.exists(path + ".npy"):
+        return np.empty((0, 6)), np.empty((0, 2), dtype=np.int64)
+    return np.load(path + ".npy", mmap_mode="r"), np.load(path + "-ranges.npy")
+
+def MissingRanges(ranges, start, end):
+    #Parts of [start, end) not covered by any of the fetched ranges
+    missing = []
+    for rangeStart, rangeEnd in ranges.tolist():
+        if rangeEnd <= start or rangeStart >= end:
+            continue
+        if rangeStart > start:
+            missing.append((start, rangeStart))
+        start = max(start, rangeEnd)
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+def StoreBars(symbol, timeframe, bars, ranges, missing):
+    #Fetches the missing ranges from BarSource, merges them into the store and saves it
+    step = TimeframeMs(timeframe)
+    now = int(datetime.now().timestamp() * 1000)
+    newBars = [np.asarray(bars).reshape(-1, 6)]
+    newRanges = [ranges]
+    for start, end in missing:
+        since = start
+        while since < end:
+            fetched = BarSource(symbol, timeframe, since, min(1000, -(-(end - since) // step)))
+            fetched = [bar for bar in fetched if bar[0] < end]
+            if len(fetched) == 0:
+                break
+            newBars.append(np.array(fetched, dtype=float))
+            since = int(fetched[-1][0]) + step
+        #bars from the future or the one still forming are left missing so they get fetched again later
+        covered = min(end, since, now - step)
+        if covered > start:
+            newRanges.append(np.array([[start, covered]], dtype=np.int64))
+
+    bars = np.concatenate(newBars)
+    bars = bars[np.unique(bars[:, 0], return_index=True)[1]]
+    ranges = np.concatenate(newRanges)
+    ranges = ranges[np.argsort(ranges[:, 0])]
+    merged = []
+    for rangeStart, rangeEnd in ranges.tolist():
+        if merged and rangeStart <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], rangeEnd)
+        else:
+            merged.append([rangeStart, rangeEnd])
+    ranges = np.array(merged, dtype=np.int64).reshape(-1, 2)
+
+    os.makedirs(BarStoreDir, exist_ok=True)
+    path = BarStorePath(symbol, timeframe)
+    #temp names carry the pid so workers saving at the same time never swap each other's half written files in
+    np.save(path + f"-{os.getpid()}-tmp.npy", bars)
+    os.replace(path + f"-{os.getpid()}-tmp.npy", path + ".npy")
+    np.save(path + f"-ranges-{os.getpid()}-tmp.npy", ranges)
+    os.replace(path + f"-ranges-{os.getpid()}-tmp.npy", path + "-ranges.npy")
+
+    return bars, ranges
+
 def HistoricalVolCalc(ClosePrice, timestamp):
     #Methods follow from Appendix B of "Options Pricing and Volatility"
     #Calculating given time-frame STD
@@ -62,68 +220,174 @@ def HistoricalVolCalc(ClosePrice, timestamp):
     
     return annualLogStd
 
-
-    
+def RollingSum(values, window):
+    #Sum of each window of values ending at every bar from one cumulative sum, NaN until the window is full of real values
+    valid = ~np.isnan(values)
+    total = np.r_[0.0, np.cumsum(np.where(valid, values, 0))]
+    count = np.r_[0, np.cumsum(valid)]
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        full = count[window:] - count[:-window] == window
+        out[window - 1:] = np.where(full, total[window:] - total[:-window], np.nan)
+    return out
+
+def RollingVariance(values, window):
+    #Sample variance of each window, like pandas' rolling std squared
+    mean = RollingSum(values, window) / window
+    return (RollingSum(values**2, window) - window * mean**2) / (window - 1)
+
+def RollingVols(bars, windows, periodsPerYear):
+    #Annualised close-to-close, Parkinson, Garman-Klass and Yang-Zhang vol over each window, as of the close of every bar
+    #bars is an (n, 6) array of [timestamp, open, high, low, close, volume], the per bar terms are worked out once and shared by every window
+    openPrice, high, low, close = bars[:, 1], bars[:, 2], bars[:, 3], bars[:, 4]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        closeReturn = np.r_[np.nan, np.log(close[1:] / close[:-1])]
+        overnight = np.r_[np.nan, np.log(openPrice[1:] / close[:-1])]
+        openClose = np.log(close / openPrice)
+        highLow = np.log(high / low)
+        rogersSatchell = np.log(high / close) * np.log(high / openPrice) + np.log(low / close) * np.log(low / openPrice)
+
+    vols = {}
+    for window in windows:
+        #close-to-close and the overnight and open-close parts of Yang-Zhang are sample variances, the others plain means
+        closeVariance = RollingVariance(closeReturn, window)
+        parkinson = RollingSum(highLow**2, window) / (4 * np.log(2) * window)
+        garmanKlass = RollingSum(0.5 * highLow**2 - (2 * np.log(2) - 1) * openClose**2, window) / window
+        k = 0.34 / (1.34 + (window + 1) / (window - 1))
+        yangZhang = RollingVariance(overnight, window) + k * RollingVariance(openClose, window) + (1 - k) * RollingSum(rogersSatchell, window) / window
+        for name, variance in (("CloseToClose", closeVariance), ("Parkinson", parkinson), ("GarmanKlass", garmanKlass), ("YangZhang", yangZhang)):
+            vols[(name, window)] = np.sqrt(np.maximum(variance, 0) * periodsPerYear)
+
+    return vols
+
+def HistVolWindowArgs():
+    #The FetchData call for the whole bar history the rolling vols are built from
+    points = (TimeframeMs("1d") * (pd.Timestamp(HistVolEnd) - pd.Timestamp(HistVolStart)).days) // TimeframeMs(HistVolTimeframe)
+    return ("BTC/USDT", HistVolTimeframe, points, HistVolStart)
+
+def HistoricalVolTable():
+    #Every estimator and window over the full bar history, put on an even grid of bar closes so HistVolAt can index straight into it
+    windows = tuple(sorted(set(HistVolWindows) | {HistVolWindow}))
+    key = HistVolWindowArgs() + (windows,)
+    if key not in HistVolTableCache:
+        history = FetchData(*HistVolWindowArgs())
+        bars = np.column_stack([BarTimes(history), history[["Open", "High", "Low", "Close", "Volume"]].to_numpy(dtype=float)])
+        step = TimeframeMs(HistVolTimeframe)
+        vols = RollingVols(bars, windows, 365 * TimeframeMs("1d") / step)
+        #gaps in the bars carry the last vol forward
+        slot = (bars[:, 0].astype(np.int64) - int(bars[0, 0])) // step
+        last = np.full(int(slot[-1]) + 1, -1)
+        last[slot] = np.arange(len(bars))
+        last = np.maximum.accumulate(last)
+        HistVolTableCache[key] = {"start": int(bars[0, 0]) + step, "step": step,
+                                  "vols": {name: np.where(last >= 0, vol[last], np.nan) for name, vol in vols.items()}}
+    return HistVolTableCache[key]
+
+def HistVolAt(times, estimator=None, window=None):
+    #HistVolEstimator over HistVolWindow bars as of the last bar closed by each time in ms, NaN where there's no history yet
+    #The table is on an even grid so each lookup is one subtraction and division
+    estimator = HistVolEstimator if estimator is None else estimator
+    window = HistVolWindow if window is None else window
+    if estimator not in ("CloseToClose", "Parkinson", "GarmanKlass", "YangZhang"):
+        raise ValueError("Invalid HistVolEstimator for HistVolAt. Must be 'CloseToClose', 'Parkinson', 'GarmanKlass' or 'YangZhang'.")
+    table = HistoricalVolTable()
+    vol = table["vols"][(estimator, window)]
+    index = (np.asarray(times, dtype=np.int64) - table["start"]) // table["step"]
+    return np.where((index >= 0) & (index < len(vol)), vol[np.clip(index, 0, len(vol) - 1)], np.nan)
+
+
+def BlackScholesTerms(spot_price, strike_price, time_to_expiration, volatility, risk_free_rate, sign, sqrtT):
+    #The Black-Scholes formulas themselves, price, delta, gamma, vega and theta of options still live
+    #sign is +1 for calls and -1 for puts, so both share the same d1 and d2 and one ndtr each
+    #BlackScholesColumns and BlackScholesScalar both come here, so batch and quote by quote pricing can't drift apart
+    #squares are multiplied out, NumPy scalars would take ** 2 through pow and round differently to the arrays
+    d1 = (np.log(spot_price / strike_price) + (risk_free_rate + 0.5 * (volatility * volatility)) * time_to_expiration) / (volatility * sqrtT)
+    d2 = d1 - volatility * sqrtT
+    discountK = strike_price * np.exp(-risk_free_rate * time_to_expiration)
+    Nd1 = ndtr(sign * d1)
+    Nd2 = ndtr(sign * d2)
+    pdf = np.exp(-0.5 * (d1 * d1)) / np.sqrt(2 * np.pi)
+
+    price = sign * (spot_price * Nd1 - discountK * Nd2)
+    delta = sign * Nd1
+    gamma = pdf / (spot_price * volatility * sqrtT)
+    vega = spot_price * pdf * sqrtT
+    theta = -spot_price * pdf * volatility / (2 * sqrtT) - sign * risk_free_rate * discountK * Nd2
+
+    return price, delta, gamma, vega, theta
+
+def BlackScholesColumns(spot_price, strike_price, time_to_expiration, volatility, risk_free_rate, isCall):
+    #Black-Scholes price, delta, gamma, vega and theta for arrays of mixed calls and puts in one pass
+    #As stated in "Option Pricing and Volatility", puts priced directly so they agree with PutCallParity
+    #Theta is per year, vega per 1.00 of vol, and anything at or past expiry is worth its intrinsic value
+    if isinstance(isCall, (bool, np.bool_)) and all(isinstance(x, float) for x in (spot_price, strike_price, time_to_expiration, volatility)):
+        return BlackScholesScalar(spot_price, strike_price, time_to_expiration, volatility, risk_free_rate, isCall)
+    spot_price, strike_price, time_to_expiration, volatility, isCall = np.broadcast_arrays(
+        np.asarray(spot_price, dtype=float), np.asarray(strike_price, dtype=float), np.asarray(time_to_expiration, dtype=float),
+        np.asarray(volatility, dtype=float), np.asarray(isCall, dtype=bool))
+    sign = np.where(isCall, 1.0, -1.0)
+    live = time_to_expiration > 0
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        sqrtT = np.sqrt(np.where(live, time_to_expiration, 1.0))
+        price, delta, gamma, vega, theta = BlackScholesTerms(spot_price, strike_price, time_to_expiration, volatility, risk_free_rate, sign, sqrtT)
+
+    intrinsic = np.maximum(sign * (spot_price - strike_price), 0)
+    price = np.where(live, price, intrinsic)
+    delta = np.where(live, delta, sign * (intrinsic > 0))
+    gamma = np.where(live, gamma, 0.0)
+    vega = np.where(live, vega, 0.0)
+    theta = np.where(live, theta, 0.0)
+
+    #[()] turns 0-d results back into plain numbers for scalar callers
+    return price[()], delta[()], gamma[()], vega[()], theta[()]
+
+def BlackScholesScalar(spot_price, strike_price, time_to_expiration, volatility, risk_free_rate, isCall):
+    #BlackScholesColumns for a single option, BlackScholesTerms on NumPy scalars without the broadcasting and masking
+    #Quote by quote callers like ImpliedVolatility spend most of their time in that set up otherwise
+    #NumPy scalars go through the same ufuncs as the arrays, so they give exactly what BlackScholesColumns does
+    spot_price, strike_price, time_to_expiration, volatility = np.float64(spot_price), np.float64(strike_price), np.float64(time_to_expiration), np.float64(volatility)
+    sign = 1.0 if isCall else -1.0
+    if not time_to_expiration > 0:
+        intrinsic = max(sign * (spot_price - strike_price), np.float64(0.0))
+        return intrinsic, np.float64(sign * (intrinsic > 0)), np.float64(0.0), np.float64(0.0), np.float64(0.0)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        return BlackScholesTerms(spot_price, strike_price, time_to_expiration, volatility, risk_free_rate, sign, np.sqrt(time_to_expiration))
 
 def BlackScholes(spot_price, strike_price, time_to_expiration, volatility, risk_free_rate, CallorPut):
 
     #Calculate the theoretical price of a call and put option using Black-Scholes Model
-    #As stated in "Option Pricing and Volatility"
-    
-    d1 = (np.log(spot_price / strike_price) + (risk_free_rate + 0.5 * volatility**2) * time_to_expiration) / (volatility * np.sqrt(time_to_expiration))
-    d2 = d1 - volatility * np.sqrt(time_to_expiration)
-    if CallorPut == "call":
-        
+    if CallorPut != "call" and CallorPut != "put":
+        raise ValueError("Invalid option type. Must be 'call' or 'put'.")
 
-        option_value = spot_price * norm.cdf(d1) - strike_price * np.exp(-risk_free_rate * time_to_expiration) * norm.cdf(d2)
-    elif CallorPut == "put":
-        option_value = strike_price * np.exp(-risk_free_rate * time_to_expiration) * norm.cdf(-d2) - spot_price * norm.cdf(-d1)
-    else:
-        print("Error in BlackScholes")
-        sys.exit()
-    
-    return option_value
+    return BlackScholesColumns(spot_price, strike_price, time_to_expiration, volatility, risk_free_rate, CallorPut == "call")[0]
 
 def PutCallParity(option_price, spot_price, strike_price, time_to_expiration, risk_free_rate, CallorPut):
     
     #Calculates price of put option given a call option
+    #Strike discounted continuously, the same as BlackScholes
     if CallorPut == "put":
     
-        put_option_price = option_price + (strike_price / (1 + risk_free_rate)**time_to_expiration) - spot_price
+        put_option_price = option_price + strike_price * np.exp(-risk_free_rate * time_to_expiration) - spot_price
     
         return put_option_price
     else:
-        call_option_price = option_price + spot_price - (strike_price / (1 + risk_free_rate) ** time_to_expiration)
+        call_option_price = option_price + spot_price - strike_price * np.exp(-risk_free_rate * time_to_expiration)
 
         return call_option_price
 
 def BidAsk(spot_price, strike_price, time_to_expiration, volatility, risk_free_rate, CallorPut, spread):
 
     #Creating some function of volatility to create different buy and sells that are still competitive in today's market.
-    
-    BuyVol = volatility - spread/2
-    SellVol = volatility + spread/2 #maybe just spread
-    TheoryCallBuyPrice = BlackScholes(spot_price, strike_price, time_to_expiration, BuyVol, risk_free_rate, "call")
-    TheoryPutBuyPrice = PutCallParity(TheoryCallBuyPrice, spot_price, strike_price, time_to_expiration, risk_free_rate, "put")
-    TheoryCallSellPrice = BlackScholes(spot_price, strike_price, time_to_expiration, SellVol, risk_free_rate, "call")
-    TheoryPutSellPrice = PutCallParity(TheoryCallSellPrice, spot_price, strike_price, time_to_expiration, risk_free_rate, "put")
-
+    if CallorPut != "call" and CallorPut != "put":
+        raise ValueError("Invalid option type. Must be 'call' or 'put'.")
 
-    if CallorPut == "call":
-        return TheoryCallBuyPrice, TheoryCallSellPrice
-    elif CallorPut == "put":
-        return TheoryPutBuyPrice, TheoryPutSellPrice
-    else:
-        print("Error with CallorPut input.")
-    
-    
+    return BidAskColumns(spot_price, strike_price, time_to_expiration, volatility, risk_free_rate, CallorPut == "call", spread)
 
 
 def ImpliedVolatility(option_price, spot, strike, T, vol_guess, r, CallorPut):
     if CallorPut == "call":
     
-        def f(vol_guess):
-            return BlackScholes(spot, strike, T, vol_guess, r, "call") - option_price
+        call_price = option_price
     else:
         call_price = PutCallParity(option_price, spot, strike, T, r, "call")
         #print("PutcallParity says: ", call_price)
@@ -132,14 +396,18 @@ def ImpliedVolatility(option_price, spot, strike, T, vol_guess, r, CallorPut):
         else:
             pass
 
-        def f(vol_guess):
-            return BlackScholes(spot, strike, T, vol_guess, r, "call") - call_price
+    def f(vol_guess):
+        return BlackScholesColumns(spot, strike, T, vol_guess, r, True)[0] - call_price
+
+    def vega(vol_guess):
+        return BlackScholesColumns(spot, strike, T, vol_guess, r, True)[3]
 
-        
     #print("working on a: ", CallorPut)
     #print("Details: ", option_price, spot, strike, T, vol_guess, r, CallorPut)
     try:
-        implied_volatility = newton(f, vol_guess)
+        #quotes with no real vol send the steps off to infinity before newton gives up
+        with np.errstate(over="ignore", divide="ignore", invalid="ignore"):
+            implied_volatility = newton(f, vol_guess, fprime=vega)
         #print("Implied vol: ", implied_volatility)
         return implied_volatility
     except RuntimeError as e:
@@ -148,28 +416,730 @@ def ImpliedVolatility(option_price, spot, strike, T, vol_guess, r, CallorPut):
         #print("Details: ", option_price, spot, strike, T, vol_guess, r, CallorPut)
         return "Error"  # or any default value or behavior you prefer
 
-def TimeMinPeriods(timestamp):
-    #for no.1 of 15 minute periods    
-    timestamp_string = timestamp
-    timestamp_format = '%Y-%m-%d %H:%M:%S.%f'
-
-    # Parse the timestamp string
-    timestamp = datetime.strptime(timestamp_string, timestamp_format)
-
-    # Calculate total minutes from midnight
-    total_minutes = timestamp.hour * 60 + timestamp.minute
-
-    # Calculate the number of 15-minute periods
-    periods_of_5_minutes = total_minutes // 5
+def OptionDataPath(inputYear, inputMonth):
+    return f"datasets/Formatted {inputYear}/{inputMonth}.csv"
 
-    return periods_of_5_minutes
+def ColumnarDataPath(inputYear, inputMonth):
+    return f"datasets/Columnar {inputYear}/{inputMonth}"
 
-
-
-            
-            
-
-def HistoricalVolTrading(inputYear, inputMonth, spread, longMax, shortMax):
+def OptionCSVColumns(optionData):
+    #Turns a formatted CSV frame into the typed columns the columnar format stores
+    #times are int64 epoch microseconds like the raw tardis files, text columns become category codes
+    columns = {}
+    for name, dtype in OptionColumnTypes.items():
+        if name not in optionData:
+            continue
+        if dtype == "time":
+            columns[name] = pd.to_datetime(optionData[name], format="ISO8601").to_numpy("datetime64[us]").astype(np.int64)
+        elif dtype == "category":
+            codes, categories = pd.factorize(optionData[name], sort=True)
+            columns[name] = codes.astype(np.int32)
+            columns[name + "-categories"] = np.asarray(categories, dtype=str)
+        else:
+            columns[name] = optionData[name].to_numpy(dtype=dtype)
+    if "expiration" in columns:
+        expiry = columns["expiration"].astype("datetime64[us]")
+        #day of the month the option expires, counted from 0, and that as a fraction of a year
+        columns["expirationDay"] = (expiry.astype("datetime64[D]") - expiry.astype("datetime64[M]")).astype(np.int16)
+        columns["yearFraction"] = columns["expirationDay"] / 365
+
+    return columns
+
+def WriteOptionColumns(columns, folder):
+    #One .npy file per column so a loader can memory map just the ones it needs
+    os.makedirs(folder, exist_ok=True)
+    for name, column in columns.items():
+        np.save(os.path.join(folder, f"{name}-{os.getpid()}-tmp.npy"), column)
+        os.replace(os.path.join(folder, f"{name}-{os.getpid()}-tmp.npy"), os.path.join(folder, f"{name}.npy"))
+
+def ConvertOptionData(inputYear, inputMonth):
+    #Builds the columnar copy of a formatted month CSV
+    WriteOptionColumns(OptionCSVColumns(pd.read_csv(OptionDataPath(inputYear, inputMonth))), ColumnarDataPath(inputYear, inputMonth))
+
+def ColumnarDataStale(inputYear, inputMonth):
+    #Whether the month's columnar copy needs building, because it isn't there or the formatted CSV has changed since
+    converted = os.path.join(ColumnarDataPath(inputYear, inputMonth), "timestamp.npy")
+    csv = OptionDataPath(inputYear, inputMonth)
+    return not os.path.exists(converted) or (os.path.exists(csv) and os.path.getmtime(converted) < os.path.getmtime(csv))
+
+def LoadOptionData(inputYear, inputMonth, names=None):
+    #A month of option quotes as a dict of NumPy arrays, only the columns asked for
+    #DatasetFormat "Columnar" memory maps the .npy columns, converting the CSV first if that hasn't been done or it has changed
+    #Category columns come back decoded, everything else is a zero copy read of the file
+    if names is None:
+        names = list(OptionColumnTypes) + ["expirationDay", "yearFraction"]
+    if DatasetFormat == "Columnar":
+        folder = ColumnarDataPath(inputYear, inputMonth)
+        if ColumnarDataStale(inputYear, inputMonth):
+            ConvertOptionData(inputYear, inputMonth)
+        columns = {}
+        for name in names:
+            column = np.load(os.path.join(folder, f"{name}.npy"), mmap_mode="r")
+            if OptionColumnTypes.get(name) == "category":
+                column = np.load(os.path.join(folder, f"{name}-categories.npy"))[column]
+            columns[name] = column
+        return columns
+    elif DatasetFormat == "CSV":
+        usecols = [name for name in names if name in OptionColumnTypes]
+        if ("expirationDay" in names or "yearFraction" in names) and "expiration" not in usecols:
+            usecols.append("expiration")
+        columns = OptionCSVColumns(pd.read_csv(OptionDataPath(inputYear, inputMonth), usecols=usecols))
+        for name in names:
+            if OptionColumnTypes.get(name) == "category":
+                columns[name] = columns[name + "-categories"][columns[name]]
+        return {name: columns[name] for name in names}
+    else:
+        raise ValueError("Invalid DatasetFormat. Must be 'CSV' or 'Columnar'.")
+
+def ChainIndexPath(inputYear, inputMonth):
+    return os.path.join(ColumnarDataPath(inputYear, inputMonth), "index")
+
+def InstrumentCodes(expirationDay, strike, isCall):
+    #One int64 per option, ordered by expiry day, strike, then puts before calls
+    return np.asarray(expirationDay, dtype=np.int64) * (1 << 40) + np.round(np.asarray(strike, dtype=float) * 100).astype(np.int64) * 2 + np.asarray(isCall, dtype=np.int64)
+
+def BuildChainIndex(inputYear, inputMonth):
+    #Sorts a month's quotes for as-of lookups and writes the index next to its columnar files
+    #byInstrument is every row grouped by option (expiry, strike, type) and in time order within each, instrumentKey the
+    #option's rank and the quote time packed into one sorted int64 so a single searchsorted finds any option's latest quote
+    #byTime is every row by (timestamp, expiry, strike) with dayOffsets where each day starts, expiryOffsets where each expiry's options start
+    data = LoadOptionData(inputYear, inputMonth, ["timestamp", "expiration", "expirationDay", "strike_price", "type"])
+    times = np.asarray(data["timestamp"], dtype=np.int64)
+    expiration = np.asarray(data["expiration"], dtype=np.int64)
+    strike = np.asarray(data["strike_price"], dtype=float)
+    code = InstrumentCodes(data["expirationDay"], strike, data["type"] == "call")
+    instruments, rank = np.unique(code, return_inverse=True)
+    base = times.min() if len(times) > 0 else 0
+
+    byInstrument = np.lexsort((times, rank))
+    byTime = np.lexsort((strike, expiration, times))
+    monthStart = np.datetime64(pd.Timestamp(f"{inputYear}-{inputMonth}-01"), "us").astype(np.int64)
+    dayStarts = monthStart + np.arange(pd.Timestamp(f"{inputYear}-{inputMonth}-01").days_in_month + 1) * TimeframeMs("1d") * 1000
+    instrumentExpiration = np.zeros(len(instruments), dtype=np.int64)
+    instrumentExpiration[rank] = expiration
+    expiries, expiryOffsets = np.unique(instrumentExpiration, return_index=True)
+
+    index = {
+        "base": np.array([base], dtype=np.int64),
+        "instrumentCode": instruments,
+        "instrumentExpiration": instrumentExpiration,
+        "byInstrument": byInstrument,
+        "instrumentOffsets": np.searchsorted(rank[byInstrument], np.arange(len(instruments) + 1)),
+        "instrumentKey": rank[byInstrument].astype(np.int64) * (1 << 42) + (times[byInstrument] - base),
+        "byTime": byTime,
+        "sortedTimes": times[byTime],
+        "dayStarts": dayStarts,
+        "dayOffsets": np.searchsorted(times[byTime], dayStarts),
+        "expiries": expiries,
+        "expiryDays": (expiries.astype("datetime64[us]").astype("datetime64[D]") - expiries.astype("datetime64[us]").astype("datetime64[M]")).astype(np.int64),
+        "expiryOffsets": np.r_[expiryOffsets, len(instruments)],
+    }
+    WriteOptionColumns(index, ChainIndexPath(inputYear, inputMonth))
+
+def ChainIndex(inputYear, inputMonth):
+    #The month's chain index from BuildChainIndex, memory mapped, and built or rebuilt whenever the data is newer
+    key = (inputYear, inputMonth, DatasetFormat)
+    if key not in ChainIndexCache:
+        source = os.path.join(ColumnarDataPath(inputYear, inputMonth), "timestamp.npy") if DatasetFormat == "Columnar" else OptionDataPath(inputYear, inputMonth)
+        built = os.path.join(ChainIndexPath(inputYear, inputMonth), "byTime.npy")
+        if not os.path.exists(built) or not os.path.exists(source) or os.path.getmtime(built) < os.path.getmtime(source):
+            BuildChainIndex(inputYear, inputMonth)
+        folder = ChainIndexPath(inputYear, inputMonth)
+        ChainIndexCache[key] = {name[:-4]: np.load(os.path.join(folder, name), mmap_mode="r") for name in os.listdir(folder) if name.endswith(".npy")}
+    return ChainIndexCache[key]
+
+def ChainTime(time):
+    #Epoch milliseconds, or anything pd.Timestamp reads like "2022-07-12 14:05", as epoch microseconds like the quote times
+    if isinstance(time, (int, np.integer, np.ndarray)):
+        return np.asarray(time, dtype=np.int64) * 1000
+    return np.int64(pd.Timestamp(time).value // 1000)
+
+def ChainRowsAsOf(index, instruments, times):
+    #Row of each instrument's latest quote at or before each time in microseconds, -1 where it has no quote yet
+    offset = np.clip(np.asarray(times, dtype=np.int64) - index["base"][0], -1, (1 << 42) - 1)
+    key = np.asarray(instruments, dtype=np.int64) * (1 << 42) + offset
+    found = np.searchsorted(index["instrumentKey"], key, side="right") - 1
+    valid = (offset >= 0) & (found >= index["instrumentOffsets"][instruments])
+    return np.where(valid, index["byInstrument"][np.maximum(found, 0)], -1)
+
+def ChainInstruments(index, expirationDay=None, strike=None, isCall=None):
+    #Rank of each option in the index, -1 for options it has no quotes for
+    #With only expirationDay (or nothing) every listed option of that expiry (or the month) instead, in expiry, strike, type order
+    if strike is None:
+        if expirationDay is None:
+            return np.arange(len(index["instrumentCode"]))
+        expiry = np.searchsorted(index["expiryDays"], expirationDay)
+        if expiry == len(index["expiryDays"]) or index["expiryDays"][expiry] != expirationDay:
+            return np.arange(0)
+        return np.arange(index["expiryOffsets"][expiry], index["expiryOffsets"][expiry + 1])
+    code = InstrumentCodes(expirationDay, strike, isCall)
+    rank = np.minimum(np.searchsorted(index["instrumentCode"], code), len(index["instrumentCode"]) - 1)
+    return np.where((len(index["instrumentCode"]) > 0) & (index["instrumentCode"][rank] == code), rank, -1)
+
+def ChainFrame(inputYear, inputMonth, rows, names):
+    #The quotes at rows as a DataFrame with readable times
+    data = LoadOptionData(inputYear, inputMonth, names)
+    frame = pd.DataFrame({name: np.asarray(data[name])[rows] for name in names})
+    for name in names:
+        if OptionColumnTypes.get(name) == "time":
+            frame[name] = pd.to_datetime(frame[name], unit="us")
+    return frame
+
+def ChainAsOf(inputYear, inputMonth, time, expirationDay=None, names=None, maxAge=None):
+    #What the chain looked like at time: the latest quote of every option (or every option of one expiry) at or before it
+    #Options that have expired by then or have no quote yet are left out, and with maxAge (ms) so are quotes older than that
+    #Sorted by expiry, strike then type, time in epoch ms or a timestamp string like "2022-07-12 14:05"
+    names = PricingColumns + ["symbol", "mark_price"] if names is None else names
+    index = ChainIndex(inputYear, inputMonth)
+    time = ChainTime(time)
+    instruments = ChainInstruments(index, expirationDay)
+    rows = ChainRowsAsOf(index, instruments, np.full(len(instruments), time))
+    keep = (rows >= 0) & (index["instrumentExpiration"][instruments] > time)
+    if maxAge is not None:
+        keep &= np.asarray(LoadOptionData(inputYear, inputMonth, ["timestamp"])["timestamp"])[np.maximum(rows, 0)] >= time - maxAge * 1000
+    return ChainFrame(inputYear, inputMonth, rows[keep], names)
+
+def ChainWindow(inputYear, inputMonth, start, end, names=None):
+    #Every quote from start up to end in (timestamp, expiry, strike) order, times like ChainAsOf's
+    names = PricingColumns + ["symbol", "mark_price"] if names is None else names
+    index = ChainIndex(inputYear, inputMonth)
+    first, last = np.searchsorted(index["sortedTimes"], [ChainTime(start), ChainTime(end)])
+    return ChainFrame(inputYear, inputMonth, index["byTime"][first:last], names)
+
+def ChainDay(inputYear, inputMonth, day, names=None):
+    #Every quote of one day of the month (counted from 0) in (timestamp, expiry, strike) order
+    names = PricingColumns + ["symbol", "mark_price"] if names is None else names
+    index = ChainIndex(inputYear, inputMonth)
+    return ChainFrame(inputYear, inputMonth, index["byTime"][index["dayOffsets"][day]:index["dayOffsets"][day + 1]], names)
+
+def QuoteTimes(optionData):
+    #Quote timestamps as int64 epoch milliseconds
+    return optionData["timestamp"] // 1000
+
+def BarTimes(bars):
+    #Opening time of each bar in a FetchData frame as int64 epoch milliseconds
+    return bars["Timestamp"].to_numpy("datetime64[ms]").astype(np.int64)
+
+def BarIndex(times, barTimes, closed=False):
+    #Index of the bar each time falls in, or with closed=True the last bar to have finished by then
+    #barTimes are bar opening times, anything before the first bar comes back as -1
+    if closed:
+        barTimes = barTimes + np.r_[np.diff(barTimes), np.diff(barTimes)[-1:]]
+    return np.searchsorted(barTimes, times, side="right") - 1
+
+def MonthBars(yearStamp, timeframe="5m"):
+    #Bars covering the whole month, starting the day before so quotes stamped just before midnight are covered
+    return FetchData(*MonthBarsWindow(yearStamp, timeframe))
+
+def MonthBarsWindow(yearStamp, timeframe):
+    #The FetchData arguments MonthBars uses
+    monthStart = pd.Timestamp(yearStamp)
+    dayBefore = (monthStart - timedelta(days=1)).strftime("%Y-%m-%d")
+    return ("BTC/USDT", timeframe, (monthStart.days_in_month + 1) * TimeframeMs("1d") // TimeframeMs(timeframe), dayBefore)
+
+def QuoteSpots(optionData, yearStamp):
+    #Spot price for every quote in optionData, taken from wherever SpotSource says
+    if SpotSource == "Dataset":
+        #the underlying price Deribit published with the quote, no fetch needed
+        return np.asarray(optionData["underlying_price"], dtype=float)
+    elif SpotSource == "Bars" or SpotSource == "AsOf":
+        #"Bars" is the close of the 5 minute bar the quote falls in, "AsOf" the last bar finished before the quote
+        monthBars = MonthBars(yearStamp)
+        bar = BarIndex(QuoteTimes(optionData), BarTimes(monthBars), closed=(SpotSource == "AsOf"))
+        return np.where(bar >= 0, monthBars["Close"].to_numpy(dtype=float)[np.maximum(bar, 0)], np.nan)
+    else:
+        raise ValueError("Invalid SpotSource. Must be 'Bars', 'Dataset' or 'AsOf'.")
+
+def OptionColumns(optionData, spot):
+    #Picks out every column the pricing needs from a LoadOptionData month
+    #Rows stay in file order so the order decisions match the row by row loop
+    columns = {
+        "time": QuoteTimes(optionData),
+        "strike": np.asarray(optionData["strike_price"], dtype=float),
+        "expirationDay": np.asarray(optionData["expirationDay"], dtype=int),
+        "expiration": np.asarray(optionData["yearFraction"]),
+        "delta": np.asarray(optionData["delta"]),
+        "type": np.asarray(optionData["type"]),
+        "spot": spot,
+        "marketBidPrice": optionData["bid_price"] * spot,
+        "marketAskPrice": optionData["ask_price"] * spot,
+    }
+    #displayed sizes and open interest in contracts for the fill model, and the exchange's implied vols in percent for IVSource
+    for name, column in (("bidAmount", "bid_amount"), ("askAmount", "ask_amount"), ("openInterest", "open_interest"),
+                         ("bidIV", "bid_iv"), ("askIV", "ask_iv"), ("markIV", "mark_iv")):
+        if column in optionData:
+            columns[name] = np.asarray(optionData[column], dtype=float)
+    #to skip same day expirations and quotes with a missing side
+    keep = (columns["expiration"] >= 0.0028) & ~np.isnan(columns["marketBidPrice"]) & ~np.isnan(columns["marketAskPrice"])
+
+    return {name: column[keep] for name, column in columns.items()}
+
+def ImpliedVolatilityColumns(option_price, spot, strike, T, vol_guess, r, isCall, maxiter=100):
+    #Array in, array out version of ImpliedVolatility
+    #Newton steps with analytic vega, falling back to bisection when a step leaves the bracket
+    #Quotes with no implied vol or that don't converge come back as NaN
+    option_price, spot, strike, T, vol_guess, isCall = np.broadcast_arrays(
+        np.asarray(option_price, dtype=float), np.asarray(spot, dtype=float), np.asarray(strike, dtype=float),
+        np.asarray(T, dtype=float), np.asarray(vol_guess, dtype=float), np.asarray(isCall, dtype=bool))
+    impliedVol = np.full(option_price.shape, np.nan)
+
+    #puts are turned into calls with PutCallParity the same way ImpliedVolatility does
+    with np.errstate(divide="ignore", invalid="ignore"):
+        call_price = np.where(isCall, option_price, PutCallParity(option_price, spot, strike, T, r, "call"))
+        intrinsic = np.maximum(spot - strike * np.exp(-r * T), 0)
+        #a call price has to sit between intrinsic value and spot for a vol to exist
+        solvable = (T > 0) & (call_price > intrinsic) & (call_price < spot)
+    idx = np.flatnonzero(solvable)
+    S = spot[idx]
+    K = strike[idx]
+    t = T[idx]
+    target = call_price[idx]
+    lo = np.zeros(len(idx))
+    hi = np.full(len(idx), VolMax)
+    guess = vol_guess[idx]
+    vol = np.where((guess > 0) & (guess < VolMax), guess, 0.5)
+
+    for _ in range(maxiter):
+        if len(idx) == 0:
+            break
+        price, _, _, vega, _ = BlackScholesColumns(S, K, t, vol, r, True)
+        diff = price - target
+
+        #call price rises with vol so the sign of diff tells us which side of the root we are
+        hi = np.where(diff > 0, vol, hi)
+        lo = np.where(diff < 0, vol, lo)
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            newVol = vol - diff / vega
+        bisect = ~((newVol > lo) & (newVol < hi))
+        newVol = np.where(bisect, 0.5 * (lo + hi), newVol)
+
+        converged = (np.abs(diff) <= IVTolerance * S) | (np.abs(newVol - vol) <= IVTolerance * vol)
+        impliedVol[idx[converged]] = np.where(np.abs(diff) <= IVTolerance * S, vol, newVol)[converged]
+
+        keep = ~converged
+        idx = idx[keep]
+        S, K, t, target = S[keep], K[keep], t[keep], target[keep]
+        lo, hi, vol = lo[keep], hi[keep], newVol[keep]
+
+    #anything pinned against the upper bracket never really had a root
+    impliedVol[impliedVol >= VolMax * (1 - IVTolerance)] = np.nan
+
+    return impliedVol
+
+def ImpliedVolatilityScalar(option_price, spot, strike, T, vol_guess, r, isCall, maxiter=100):
+    #ImpliedVolatilityColumns for a single quote, the same bracketed Newton steps on NumPy scalars so it lands on exactly the same vol
+    #NaN where there isn't one
+    option_price, spot, strike, T = np.float64(option_price), np.float64(spot), np.float64(strike), np.float64(T)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        call_price = option_price if isCall else PutCallParity(option_price, spot, strike, T, r, "call")
+        intrinsic = np.maximum(spot - strike * np.exp(-r * T), 0)
+        if not (T > 0 and call_price > intrinsic and call_price < spot):
+            return np.nan
+    lo = 0.0
+    hi = VolMax
+    vol = np.float64(vol_guess if 0 < vol_guess < VolMax else 0.5)
+    sqrtT = np.sqrt(T)
+
+    #BlackScholesTerms straight on the scalars and one errstate for the whole solve, setting either up costs more than a step
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        for _ in range(maxiter):
+            price, _, _, vega, _ = BlackScholesTerms(spot, strike, T, vol, r, 1.0, sqrtT)
+            diff = price - call_price
+
+            if diff > 0:
+                hi = vol
+            if diff < 0:
+                lo = vol
+            newVol = vol - diff / vega
+            if not (newVol > lo and newVol < hi):
+                newVol = 0.5 * (lo + hi)
+
+            if abs(diff) <= IVTolerance * spot:
+                impliedVol = vol
+                break
+            if abs(newVol - vol) <= IVTolerance * vol:
+                impliedVol = newVol
+                break
+            vol = newVol
+        else:
+            return np.nan
+
+    #anything pinned against the upper bracket never really had a root
+    return np.nan if impliedVol >= VolMax * (1 - IVTolerance) else float(impliedVol)
+
+def ExchangeImpliedVols(exchangeIV):
+    #The dataset's implied vols, in percent, as vols, NaN where the exchange had none (missing or zero)
+    vol = np.asarray(exchangeIV, dtype=float) / 100
+    return np.where(vol > 0, vol, np.nan)
+
+def ExchangeVolError(option_price, exchangeVol, spot, strike, T, r, isCall):
+    #Roughly how far the exchange's vol is from the one that reprices option_price, the repricing error over vega
+    price, _, _, vega, _ = BlackScholesColumns(spot, strike, T, exchangeVol, r, isCall)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.abs(price - option_price) / vega
+
+def SolveImpliedVols(option_price, columns, rows, vol_guess):
+    #Solves the implied vol of option_price at each of rows with IVSolver, NaN where there isn't one
+    vol_guess = np.broadcast_to(vol_guess, columns["strike"].shape)
+    if IVSolver == "Batch":
+        isCall = columns["type"][rows] == "call"
+        return ImpliedVolatilityColumns(option_price[rows], columns["spot"][rows], columns["strike"][rows], columns["expiration"][rows], vol_guess[rows], RFR, isCall)
+    impliedVol = np.empty(len(rows))
+    for n, row in enumerate(rows.tolist()):
+        vol = ImpliedVolatility(option_price[row], columns["spot"][row], columns["strike"][row], columns["expiration"][row], vol_guess[row], RFR, columns["type"][row])
+        impliedVol[n] = np.nan if isinstance(vol, str) else vol
+    return impliedVol
+
+def ImpliedVolatilityQuote(option_price, spot, strike, T, vol_guess, r, CallorPut):
+    #One quote's implied vol with IVSolver, "Error" when there isn't one, so quote by quote callers solve the same way SolveImpliedVols does
+    if IVSolver == "Batch":
+        vol = ImpliedVolatilityScalar(option_price, spot, strike, T, vol_guess, r, CallorPut == "call")
+        return "Error" if math.isnan(vol) else vol
+    return ImpliedVolatility(option_price, spot, strike, T, vol_guess, r, CallorPut)
+
+def SourceImpliedVols(columns, vol_guess):
+    #Ask and bid implied vols from wherever IVSource says, NaN where there isn't one, and counts of where they came from
+    #"Reconcile" starts the solver at the exchange's mark vol where there is one
+    rows = np.arange(len(columns["strike"]))
+    prices = {"ask": columns["marketAskPrice"], "bid": columns["marketBidPrice"]}
+    stats = {"quotes": 2 * len(rows), "exchange": 0, "solved": 0, "missing": 0, "disagreed": 0, "unsolved": 0, "meanDisagreement": np.nan}
+    if IVSource == "Solve":
+        vols = {side: SolveImpliedVols(prices[side], columns, rows, vol_guess) for side in prices}
+        stats["solved"] = sum(int((~np.isnan(vol)).sum()) for vol in vols.values())
+    elif IVSource == "Exchange" or IVSource == "Reconcile":
+        vols = {"ask": ExchangeImpliedVols(columns["askIV"]), "bid": ExchangeImpliedVols(columns["bidIV"])}
+        if IVSource == "Reconcile":
+            isCall = columns["type"] == "call"
+            markVol = ExchangeImpliedVols(columns["markIV"])
+            guess = np.where(np.isnan(markVol), vol_guess, markVol)
+            disagreement = []
+            for side in vols:
+                missing = np.isnan(vols[side])
+                trusted = ExchangeVolError(prices[side], vols[side], columns["spot"], columns["strike"], columns["expiration"], RFR, isCall) <= IVReconcileTolerance
+                solve = np.flatnonzero(~trusted)
+                exchangeVol = vols[side][solve]
+                vols[side][solve] = SolveImpliedVols(prices[side], columns, solve, guess)
+                stats["missing"] += int(missing.sum())
+                stats["disagreed"] += int((~trusted & ~missing).sum())
+                stats["solved"] += int((~np.isnan(vols[side][solve])).sum())
+                disagreement.append(np.abs(vols[side][solve] - exchangeVol))
+            disagreement = np.concatenate(disagreement)
+            if (~np.isnan(disagreement)).any():
+                stats["meanDisagreement"] = np.nanmean(disagreement)
+        else:
+            stats["missing"] = sum(int(np.isnan(vol).sum()) for vol in vols.values())
+    else:
+        raise ValueError("Invalid IVSource. Must be 'Solve', 'Exchange' or 'Reconcile'.")
+    stats["unsolved"] = sum(int(np.isnan(vol).sum()) for vol in vols.values())
+    stats["exchange"] = stats["quotes"] - stats["solved"] - stats["unsolved"] if IVSource != "Solve" else 0
+
+    return vols["ask"], vols["bid"], stats
+
+def ImpliedVolatilityFromSource(option_price, exchangeIV, markIV, spot, strike, T, vol_guess, r, CallorPut):
+    #ImpliedVolatilityQuote for one quote from wherever IVSource says, "Error" when there isn't one, for the row by row loops and Replay
+    if IVSource == "Solve":
+        return ImpliedVolatilityQuote(option_price, spot, strike, T, vol_guess, r, CallorPut)
+    exchangeVol = float(ExchangeImpliedVols(exchangeIV))
+    if IVSource == "Exchange":
+        return "Error" if math.isnan(exchangeVol) else exchangeVol
+    elif IVSource == "Reconcile":
+        if ExchangeVolError(option_price, exchangeVol, spot, strike, T, r, CallorPut == "call") <= IVReconcileTolerance:
+            return exchangeVol
+        markVol = float(ExchangeImpliedVols(markIV))
+        return ImpliedVolatilityQuote(option_price, spot, strike, T, vol_guess if math.isnan(markVol) else markVol, r, CallorPut)
+    else:
+        raise ValueError("Invalid IVSource. Must be 'Solve', 'Exchange' or 'Reconcile'.")
+
+def ColumnImpliedVols(columns, vol_guess):
+    #Bid and ask implied vol for every row from IVSource, drops the rows that have none
+    AskimpliedVol, BidimpliedVol, stats = SourceImpliedVols(columns, vol_guess)
+    solved = ~np.isnan(AskimpliedVol) & ~np.isnan(BidimpliedVol)
+
+    columns = {name: column[solved] for name, column in columns.items()}
+    columns["AskimpliedVol"] = AskimpliedVol[solved]
+    columns["BidimpliedVol"] = BidimpliedVol[solved]
+
+    return columns
+
+def UpdateVolState(volState, expirationDay, strike, marketVol, HistVol, time=None):
+    #Folds one quote's market implied vol into the estimate for its expiry (and strike bucket) and returns the new estimate
+    #volState is a dict of entries [expirationDay, vol, count, strikeBucket, history, window], history the (time, vol) of every update
+    bucket = None if VolStrikeBucket is None else int(strike // VolStrikeBucket)
+    entry = volState.get((expirationDay, bucket))
+    if entry is None:
+        #seeded with HistVol * market vol like the original scan, or just the market vol
+        #"Window" starts with nothing in its window, the seed only stands in until the next quote, which replaces it outright
+        vol = HistVol * marketVol if VolSeed == "HistVol" else marketVol
+        entry = [expirationDay, vol, 1, bucket, [], deque()]
+        volState[(expirationDay, bucket)] = entry
+    else:
+        entry[2] += 1
+        if VolEstimator == "Mean":
+            entry[1] = ((entry[2]-1)/entry[2]) * entry[1] + (1/entry[2]) * marketVol
+        elif VolEstimator == "EWMA":
+            entry[1] = (1 - VolDecay) * entry[1] + VolDecay * marketVol
+        elif VolEstimator == "Window":
+            window = entry[5]
+            window.append(marketVol)
+            if len(window) > VolWindow:
+                entry[1] += (marketVol - window.popleft()) / VolWindow
+            else:
+                entry[1] += (marketVol - entry[1]) / len(window)
+        else:
+            raise ValueError("Invalid VolEstimator. Must be 'Mean', 'EWMA' or 'Window'.")
+    entry[4].append((time, entry[1]))
+
+    return entry[1]
+
+def ExpiryVolPath(expirationDay, MarketImpliedVol, HistVol, strike=None, times=None):
+    #Our vol for each quote from UpdateVolState, in quote order, and the entries as volDataByExpiry
+    volState = {}
+    volatility = np.empty(len(MarketImpliedVol))
+    strike = [None] * len(MarketImpliedVol) if strike is None else strike.tolist()
+    times = [None] * len(MarketImpliedVol) if times is None else times.tolist()
+    for n, (day, marketVol) in enumerate(zip(expirationDay.tolist(), MarketImpliedVol.tolist())):
+        volatility[n] = UpdateVolState(volState, day, strike[n], marketVol, HistVol, times[n])
+
+    return volatility, list(volState.values())
+
+def VolHistory(volDataByExpiry):
+    #Every update of every estimate as a table to replay or plot, time in epoch milliseconds
+    #strikeBucket is NaN for estimates kept per expiry, as floats rather than a column of objects holding None
+    rows = [(time, entry[0], entry[3], vol) for entry in volDataByExpiry for time, vol in entry[4]]
+    return pd.DataFrame(rows, columns=["time", "expirationDay", "strikeBucket", "vol"]).astype({"strikeBucket": float}).sort_values("time", kind="stable", ignore_index=True)
+
+def BidAskColumns(spot_price, strike_price, time_to_expiration, volatility, risk_free_rate, isCall, spread):
+    #BidAsk for a whole column of mixed calls and puts in one go
+    BuyVol = volatility - spread/2
+    SellVol = volatility + spread/2
+    MyBidPrice = BlackScholesColumns(spot_price, strike_price, time_to_expiration, BuyVol, risk_free_rate, isCall)[0]
+    MyAskPrice = BlackScholesColumns(spot_price, strike_price, time_to_expiration, SellVol, risk_free_rate, isCall)[0]
+
+    return MyBidPrice, MyAskPrice
+
+def FillLimits(columns, volatility, rows, longMax, shortMax):
+    #The position limits each of rows counts towards, as (keys, long caps, short caps, exposure per contract bought)
+    #One entry per limit: the option type (longMax/shortMax), expiry, the option itself and portfolio delta and vega
+    #A limit with the same key for every row is a portfolio limit, caps are None where there is no limit
+    CallorPut = columns["type"][rows].tolist()
+    limits = [(CallorPut, [longMax] * len(rows), [shortMax] * len(rows), [1.0] * len(rows))]
+    if ExpiryLimit is not None:
+        limits.append((columns["expirationDay"][rows].tolist(), [ExpiryLimit] * len(rows), [ExpiryLimit] * len(rows), [1.0] * len(rows)))
+    if ContractLimit is not None or OpenInterestShare is not None:
+        cap = np.full(len(rows), np.inf if ContractLimit is None else ContractLimit, dtype=float)
+        if OpenInterestShare is not None:
+            cap = np.minimum(cap, OpenInterestShare * columns["openInterest"][rows])
+        keys = list(zip(CallorPut, columns["expirationDay"][rows].tolist(), columns["strike"][rows].tolist()))
+        limits.append((keys, cap.tolist(), cap.tolist(), [1.0] * len(rows)))
+    if DeltaLimit is not None:
+        limits.append(([None] * len(rows), [DeltaLimit] * len(rows), [DeltaLimit] * len(rows), columns["delta"][rows].tolist()))
+    if VegaLimit is not None:
+        vega = BlackScholesColumns(columns["spot"][rows], columns["strike"][rows], columns["expiration"][rows], np.broadcast_to(volatility, columns["strike"].shape)[rows],
+                                   RFR, columns["type"][rows] == "call")[3]
+        limits.append(([None] * len(rows), [VegaLimit] * len(rows), [VegaLimit] * len(rows), vega.tolist()))
+    return limits
+
+def UnitFills():
+    #Whether orders fill like the Rows loops, one contract a quote with only the call and put limits
+    return FillModel == "Unit" and all(limit is None for limit in (ExpiryLimit, ContractLimit, OpenInterestShare, DeltaLimit, VegaLimit))
+
+def FillSizes(columns, rows, orderSize=None):
+    #Contracts we try to sell into each row's bid and buy from its ask before any limits
+    #FillModel "Unit" is one contract a quote like the original loop, "Depth" FillShare of the displayed size up to OrderSize
+    #Passing orderSize uses "Depth" with that cap whatever FillModel is
+    if orderSize is None and FillModel == "Unit":
+        return np.ones(len(rows)), np.ones(len(rows))
+    elif orderSize is None and FillModel != "Depth":
+        raise ValueError("Invalid FillModel. Must be 'Unit' or 'Depth'.")
+    orderSize = OrderSize if orderSize is None else orderSize
+    cap = np.inf if orderSize is None else orderSize
+    return np.minimum(FillShare * columns["bidAmount"][rows], cap), np.minimum(FillShare * columns["askAmount"][rows], cap)
+
+def PlaceOrders(columns, volatility, MyBidPrice, MyAskPrice, longMax, shortMax, orderSize=None):
+    #Only the position limited order decision is done row by row, the trades are then gathered into a ledger
+    #Rows where neither side is mispriced can never trade so they are skipped
+    #Each fill is the size FillSizes wants cut down to what every limit in FillLimits still has room for,
+    #in whole contracts for FillModel "Unit" or steps of FillStep otherwise, and nothing if that comes to less than one step
+    wantSell = columns["marketBidPrice"] > MyAskPrice
+    wantBuy = columns["marketAskPrice"] < MyBidPrice
+    myVol = np.broadcast_to(volatility, wantSell.shape)
+    candidates = np.flatnonzero(wantSell | wantBuy)
+    step = 1.0 if orderSize is None and FillModel == "Unit" else FillStep
+    sellSize, buySize = FillSizes(columns, candidates, orderSize)
+    limits = FillLimits(columns, volatility, candidates, longMax, shortMax)
+    #net exposure held against each limit's keys, +1 per contract bought
+    held = [{} for limit in limits]
+    positions = held[0]
+    positions.update({"call": 0, "put": 0})
+    traded = []
+    sides = []
+    sizes = []
+
+    CallorPut = columns["type"][candidates].tolist()
+    sell = wantSell[candidates].tolist()
+    buy = wantBuy[candidates].tolist()
+    sellSize = sellSize.tolist()
+    buySize = buySize.tolist()
+    for n, row in enumerate(candidates.tolist()):
+        if CallorPut[n] not in positions:
+            continue
+        for side, wanted, size in ((-1, sell[n], sellSize[n]), (1, buy[n], buySize[n])):
+            if not wanted:
+                continue
+            for (keys, longCap, shortCap, exposure), exposures in zip(limits, held):
+                change = side * exposure[n]
+                current = exposures.get(keys[n], 0)
+                if change > 0:
+                    size = min(size, (longCap[n] - current) / change)
+                elif change < 0:
+                    size = min(size, (current + shortCap[n]) / -change)
+            size = math.floor(size / step + 1e-9) * step
+            if size >= step:
+                break
+        else:
+            continue
+        for (keys, longCap, shortCap, exposure), exposures in zip(limits, held):
+            exposures[keys[n]] = exposures.get(keys[n], 0) + side * size * exposure[n]
+        traded.append(row)
+        sides.append(side)
+        sizes.append(size)
+
+    #bought first then sold, each in the order they were placed
+    order = np.argsort(-np.array(sides, dtype=int), kind="stable")
+    rows = np.array(traded, dtype=int)[order]
+    isBuy = np.array(sides, dtype=int)[order] == 1
+    ledger = np.zeros(len(rows), dtype=TradeLedgerType)
+    ledger["time"] = columns["time"][rows]
+    ledger["isCall"] = columns["type"][rows] == "call"
+    ledger["side"] = np.where(isBuy, 1, -1)
+    ledger["size"] = np.array(sizes, dtype=float)[order]
+    ledger["expirationDay"] = columns["expirationDay"][rows]
+    ledger["strike"] = columns["strike"][rows]
+    ledger["price"] = np.where(isBuy, columns["marketAskPrice"][rows], columns["marketBidPrice"][rows])
+    ledger["delta"] = columns["delta"][rows]
+    ledger["marketVol"] = np.where(isBuy, 100*columns["AskimpliedVol"][rows], 100*columns["BidimpliedVol"][rows])
+    ledger["myVol"] = myVol[rows]
+
+    return ledger
+
+def TradeLedger(BuyList, SellList, BuyTimes=None, SellTimes=None):
+    #Ledger from order lists [CallorPut, expirationDay, strike, price, delta, market vol, my vol, "Buy" or "Sell"]
+    orders = BuyList + SellList
+    ledger = np.zeros(len(orders), dtype=TradeLedgerType)
+    if BuyTimes is not None and SellTimes is not None:
+        ledger["time"] = list(BuyTimes) + list(SellTimes)
+    ledger["isCall"] = [entry[0] == "call" for entry in orders]
+    ledger["side"] = [1] * len(BuyList) + [-1] * len(SellList)
+    ledger["size"] = 1
+    for n, name in ((1, "expirationDay"), (2, "strike"), (3, "price"), (4, "delta"), (5, "marketVol"), (6, "myVol")):
+        ledger[name] = [entry[n] for entry in orders]
+    return ledger
+
+def LedgerOrders(ledger):
+    #Back to BuyList and SellList order lists, for the row by row reference code
+    orders = [["call" if isCall else "put", day, strike, price, delta, marketVol, myVol, "Buy" if side == 1 else "Sell"]
+              for isCall, day, strike, price, delta, marketVol, myVol, side in zip(ledger["isCall"].tolist(), ledger["expirationDay"].tolist(),
+              ledger["strike"].tolist(), ledger["price"].tolist(), ledger["delta"].tolist(), ledger["marketVol"].tolist(), ledger["myVol"].tolist(), ledger["side"].tolist())]
+    side = ledger["side"].tolist()
+    return [order for order, s in zip(orders, side) if s == 1], [order for order, s in zip(orders, side) if s == -1]
+
+def LedgerFrame(ledger):
+    #The ledger as a DataFrame with readable type and side columns
+    frame = pd.DataFrame(ledger)
+    frame.insert(1, "type", np.where(ledger["isCall"], "call", "put"))
+    frame["action"] = np.where(ledger["side"] == 1, "Buy", "Sell")
+    frame["total"] = ledger["profit"] + ledger["hedgeCash"]
+    return frame.drop(columns="isCall")
+
+def SettleLedger(ledger, month):
+    #Expiry P&L of every trade against the close on its expiry day, returns the total and a copy of the ledger with profit filled in
+    #Added up in ledger order like ProfitLoss so the total comes out the same
+    expiryPrice = FetchData("BTC/USDT", "1d", 31, month)["Close"].to_numpy(dtype=float)
+    ledger = ledger.copy()
+    expiryDayPrice = expiryPrice[ledger["expirationDay"]]
+    payoff = np.where(ledger["isCall"], np.maximum(expiryDayPrice - ledger["strike"], 0), np.maximum(ledger["strike"] - expiryDayPrice, 0))
+    ledger["profit"] = np.where(ledger["side"] == 1, payoff - ledger["price"], -(payoff - ledger["price"])) * ledger["size"]
+    profit = np.cumsum(ledger["profit"])[-1] if len(ledger) > 0 else 0
+
+    return profit, ledger
+
+def LedgerProfit(ledger, year, month, deltaTrading):
+    #Hedges the month's trades if deltaTrading and settles them, as profit, MoneyMakers and MoneyLosers
+    #MoneyMakers and MoneyLosers are the trades whose option made or lost money, each still a ledger
+    if deltaTrading == True:
+        deltaProfit, ledger = HedgeLedger(ledger, year, month)
+    else:
+        deltaProfit = 0
+    optionProfit, ledger = SettleLedger(ledger, f"{year}-{month}-01")
+
+    return optionProfit + deltaProfit, ledger[ledger["profit"] >= 0], ledger[ledger["profit"] < 0]
+
+def ColumnQuotes(columns, volatility, spread):
+    #Our bid and ask for every row at the given vol
+    isCall = columns["type"] == "call"
+    return BidAskColumns(columns["spot"], columns["strike"], columns["expiration"], volatility, RFR, isCall, spread)
+
+def HistoricalVolColumns(optionData, spots, volatility, spread, longMax, shortMax):
+    #Columnar version of the HistoricalVolTrading loop
+    columns = ColumnImpliedVols(OptionColumns(optionData, spots), volatility)
+    if HistVolEstimator != "Month":
+        volatility = HistVolAt(columns["time"])
+    MyBidPrice, MyAskPrice = ColumnQuotes(columns, volatility, spread)
+
+    return PlaceOrders(columns, volatility, MyBidPrice, MyAskPrice, longMax, shortMax)
+
+def ImpliedVolColumns(optionData, spots, HistVol, spread, longMax, shortMax):
+    #Columnar version of the ImpliedVolTrading loop
+    columns = ColumnImpliedVols(OptionColumns(optionData, spots), HistVol)
+    MarketImpliedVol = (columns["AskimpliedVol"] + columns["BidimpliedVol"])/2
+    volatility, volDataByExpiry = ExpiryVolPath(columns["expirationDay"], MarketImpliedVol, HistVol, columns["strike"], columns["time"])
+    MyBidPrice, MyAskPrice = ColumnQuotes(columns, volatility, spread)
+    ledger = PlaceOrders(columns, volatility, MyBidPrice, MyAskPrice, longMax, shortMax)
+
+    return ledger, volDataByExpiry
+
+def SurfaceFit(times, expirationDay, logMoneyness, impliedVol):
+    #Fits a smile vol = a + b*k + c*k^2 in log-moneyness k to each expiry's quotes in every SurfaceBucket wide snapshot
+    #All the snapshots are solved together as a batch of 3x3 least squares problems
+    #The ridge on b and c keeps snapshots with only one or two strikes flat rather than singular
+    key = np.asarray(expirationDay, dtype=np.int64) * (1 << 40) + np.asarray(times, dtype=np.int64) // TimeframeMs(SurfaceBucket)
+    snapshots, snapshot = np.unique(key, return_inverse=True)
+    X = np.stack([np.ones(len(logMoneyness)), logMoneyness, logMoneyness**2], axis=1)
+    XtX = np.empty((len(snapshots), 3, 3))
+    Xty = np.empty((len(snapshots), 3))
+    for row in range(3):
+        Xty[:, row] = np.bincount(snapshot, X[:, row] * impliedVol, minlength=len(snapshots))
+        for col in range(3):
+            XtX[:, row, col] = np.bincount(snapshot, X[:, row] * X[:, col], minlength=len(snapshots))
+    XtX[:, 1, 1] += SurfaceSmoothing
+    XtX[:, 2, 2] += SurfaceSmoothing
+
+    return {"key": snapshots, "params": np.linalg.solve(XtX, Xty[:, :, None])[:, :, 0]}
+
+def SurfaceVol(surface, strike, expirationDay, times, spot):
+    #Model vol at any (strike, expiry day, time in ms) from the last snapshot of that expiry finished before the time
+    #NaN before an expiry's first snapshot, so nothing is priced off a fit that used later quotes
+    expirationDay = np.asarray(expirationDay, dtype=np.int64)
+    logMoneyness = np.log(np.asarray(strike, dtype=float) / (np.asarray(spot, dtype=float) * np.exp(RFR * expirationDay/365)))
+    key = expirationDay * (1 << 40) + np.asarray(times, dtype=np.int64) // TimeframeMs(SurfaceBucket)
+    found = np.searchsorted(surface["key"], key) - 1
+    valid = (found >= 0) & (surface["key"][np.maximum(found, 0)] >> 40 == expirationDay)
+    a, b, c = surface["params"][np.maximum(found, 0)].T
+    vol = a + b * logMoneyness + c * logMoneyness**2
+
+    return np.where(valid & (vol > 0), vol, np.nan)
+
+def SurfaceColumnVols(columns):
+    #Fits the surface to the solved quotes' mid vols and prices each quote off it
+    logMoneyness = np.log(columns["strike"] / (columns["spot"] * np.exp(RFR * columns["expiration"])))
+    MarketImpliedVol = (columns["AskimpliedVol"] + columns["BidimpliedVol"])/2
+    surface = SurfaceFit(columns["time"], columns["expirationDay"], logMoneyness, MarketImpliedVol)
+
+    return SurfaceVol(surface, columns["strike"], columns["expirationDay"], columns["time"], columns["spot"]), surface
+
+
+def MonthStamps(inputYear, inputMonth):
+    #"YYYY-MM-01" for the month and the month before it
     inputMonthList = ["01","02","03","04","05","06","07","08","09","10","11","12"]
     if inputMonth == "01":
         preMonthYear = str(int(inputYear)-1)
@@ -180,236 +1150,238 @@ def HistoricalVolTrading(inputYear, inputMonth, spread, longMax, shortMax):
         preMonthYear = inputYear
     yearStamp = f"{inputYear}-{inputMonth}-01"
     preMonthStamp = f"{preMonthYear}-{preMonth}-01"
+
+    return yearStamp, preMonthStamp
+
+def HistoricalVolTrading(inputYear, inputMonth, spread, longMax, shortMax):
+    yearStamp, preMonthStamp = MonthStamps(inputYear, inputMonth)
         
-    file_path = f"datasets/Formatted {inputYear}/{inputMonth}.csv"
-    optionData = pd.read_csv(file_path)
-    options = []
+    optionData = LoadOptionData(inputYear, inputMonth, PricingColumns)
     BuyList = []
     SellList = []
     currentCallPosition = 0
     currentPutPosition = 0
-    i = 0
     dayVolData = FetchData("BTC/USDT", "1d", 30, preMonthStamp)
     volatility = HistoricalVolCalc(dayVolData["Close"], dayVolData["Timestamp"])
-    DayPrice = FetchData("BTC/USDT", "5m", 500, yearStamp)
-    for i in range(len(optionData)):
-
-        formattedTimestamp = TimeMinPeriods(optionData["timestamp"][i])
-
-
-        strike = float(optionData.iloc[i]["strike_price"])
-        expiration = (float(optionData.iloc[i]["expiration"][8:10]) - 1)/365
-        iDelta = float(optionData.iloc[i]["delta"])
-        #iBidIV = float(optionData.iloc[i]["bid_iv"])
-        #iAskIV = float(optionData.iloc[i]["ask_iv"])         
-
-        expirationDay = (int(optionData.iloc[i]["expiration"][8:10]) - 1)
-        CallorPut = optionData.iloc[i]["type"]
-        spot = float(DayPrice.iloc[formattedTimestamp]["Close"])
-        marketBidPrice = optionData.iloc[i]["bid_price"] * spot
-        marketAskPrice = optionData.iloc[i]["ask_price"] * spot
+    HistVol = volatility
+    spots = QuoteSpots(optionData, yearStamp)
+    if Engine == "Columnar":
+        ledger = HistoricalVolColumns(optionData, spots, volatility, spread, longMax, shortMax)
+    else:
+        if not UnitFills():
+            raise ValueError("FillModel 'Depth' and the position limits need Engine = 'Columnar'.")
+        times = QuoteTimes(optionData)
+        BuyTimes = []
+        SellTimes = []
+        if HistVolEstimator != "Month":
+            quoteVols = HistVolAt(times)
+        for i in range(len(times)):
+
+            strike = float(optionData["strike_price"][i])
+            expiration = float(optionData["yearFraction"][i])
+            iDelta = float(optionData["delta"][i])
+            iBidIV = float(optionData["bid_iv"][i])
+            iAskIV = float(optionData["ask_iv"][i])
+            iMarkIV = float(optionData["mark_iv"][i])
+
+            expirationDay = int(optionData["expirationDay"][i])
+            CallorPut = str(optionData["type"][i])
+            spot = float(spots[i])
+            marketBidPrice = float(optionData["bid_price"][i]) * spot
+            marketAskPrice = float(optionData["ask_price"][i]) * spot
 
 
         
-        if expiration < 0.0028 or math.isnan(marketBidPrice) or math.isnan(marketAskPrice):
-            continue #to skip same day expirations
+            if expiration < 0.0028 or math.isnan(marketBidPrice) or math.isnan(marketAskPrice):
+                continue #to skip same day expirations
         
 
-        AskimpliedVol = ImpliedVolatility(marketAskPrice, spot, strike, expiration, volatility, RFR, CallorPut)
-        BidimpliedVol = ImpliedVolatility(marketBidPrice, spot, strike, expiration, volatility, RFR, CallorPut)
-        if AskimpliedVol == "Error" or BidimpliedVol == "Error":
-            continue
+            AskimpliedVol = ImpliedVolatilityFromSource(marketAskPrice, iAskIV, iMarkIV, spot, strike, expiration, HistVol, RFR, CallorPut)
+            BidimpliedVol = ImpliedVolatilityFromSource(marketBidPrice, iBidIV, iMarkIV, spot, strike, expiration, HistVol, RFR, CallorPut)
+            if AskimpliedVol == "Error" or BidimpliedVol == "Error":
+                continue
+            if HistVolEstimator != "Month":
+                volatility = float(quoteVols[i])
         
 
-        #print("My Black Scholes Inputs: \n Strike: ", strike, "\n Exp", expiration, "\n Vol: ", volatility)
+            #print("My Black Scholes Inputs: \n Strike: ", strike, "\n Exp", expiration, "\n Vol: ", volatility)
         
-        if CallorPut == "call":
             MyBidPrice, MyAskPrice = BidAsk(spot, strike, expiration, volatility, RFR, CallorPut, spread)
-            MyOptionPrice = BlackScholes(spot, strike, expiration, volatility, RFR, CallorPut)
-        else:
-            MyBidPrice, MyAskPrice = BidAsk(spot, strike, expiration, volatility, RFR, CallorPut, spread)
-            callPrice = BlackScholes(spot, strike, expiration, volatility, RFR, CallorPut)
-            MyOptionPrice = PutCallParity(callPrice,spot, strike, expiration, RFR, "put")
 
         
-        if CallorPut == "call":
-            if marketBidPrice > MyAskPrice and currentCallPosition > -shortMax:
-                order = [CallorPut, expirationDay, strike, marketBidPrice, iDelta, 100*BidimpliedVol, volatility, "Sell"]
-                #create sell order
-                SellList.append(order)
-                #print("Market Bid Price: ",marketBidPrice," and my Ask Price: ", MyAskPrice)
-                #print("Sell order")
-                currentCallPosition -= 1
-            elif marketAskPrice < MyBidPrice and currentCallPosition < longMax:
-                #create buy order
-                order = [CallorPut, expirationDay, strike, marketAskPrice, iDelta, 100*AskimpliedVol, volatility, "Buy"]
-                #print("Market ask Price: ",marketAskPrice," and my bid Price: ", MyBidPrice)
-                #print("My implied vol: ", AskimpliedVol)
-                BuyList.append(order)
-                #print("Buy order")
-                currentCallPosition += 1
-                if AskimpliedVol > volatility:
-                    print("WHY ARE YOU BUYING")
-        elif CallorPut == "put":
-            if marketBidPrice > MyAskPrice and currentPutPosition > -shortMax:
-                order = [CallorPut, expirationDay, strike, marketBidPrice, iDelta, 100*BidimpliedVol, volatility, "Sell"]
-                #create sell order
-                SellList.append(order)
-                #print("Market Bid Price: ",marketBidPrice," and my Ask Price: ", MyAskPrice)
-                #print("Sell order")
-                currentPutPosition -= 1
-            elif marketAskPrice < MyBidPrice and currentPutPosition < longMax:
-                #create buy order
-                order = [CallorPut, expirationDay, strike, marketAskPrice, iDelta, 100*AskimpliedVol, volatility, "Buy"]
-                #print("Market ask Price: ",marketAskPrice," and my bid Price: ", MyBidPrice)
-                #print("My implied vol: ", AskimpliedVol)
-                BuyList.append(order)
-                #print("Buy order")
-                currentPutPosition += 1
-                if AskimpliedVol > volatility:
-                    print("WHY ARE YOU BUYING")
-        else:
-            pass
-    
+            if CallorPut == "call":
+                if marketBidPrice > MyAskPrice and currentCallPosition > -shortMax:
+                    order = [CallorPut, expirationDay, strike, marketBidPrice, iDelta, 100*BidimpliedVol, volatility, "Sell"]
+                    #create sell order
+                    SellList.append(order)
+                    SellTimes.append(int(times[i]))
+                    #print("Market Bid Price: ",marketBidPrice," and my Ask Price: ", MyAskPrice)
+                    #print("Sell order")
+                    currentCallPosition -= 1
+                elif marketAskPrice < MyBidPrice and currentCallPosition < longMax:
+                    #create buy order
+                    order = [CallorPut, expirationDay, strike, marketAskPrice, iDelta, 100*AskimpliedVol, volatility, "Buy"]
+                    #print("Market ask Price: ",marketAskPrice," and my bid Price: ", MyBidPrice)
+                    #print("My implied vol: ", AskimpliedVol)
+                    BuyList.append(order)
+                    BuyTimes.append(int(times[i]))
+                    #print("Buy order")
+                    currentCallPosition += 1
+                    if AskimpliedVol > volatility:
+                        print("WHY ARE YOU BUYING")
+            elif CallorPut == "put":
+                if marketBidPrice > MyAskPrice and currentPutPosition > -shortMax:
+                    order = [CallorPut, expirationDay, strike, marketBidPrice, iDelta, 100*BidimpliedVol, volatility, "Sell"]
+                    #create sell order
+                    SellList.append(order)
+                    SellTimes.append(int(times[i]))
+                    #print("Market Bid Price: ",marketBidPrice," and my Ask Price: ", MyAskPrice)
+                    #print("Sell order")
+                    currentPutPosition -= 1
+                elif marketAskPrice < MyBidPrice and currentPutPosition < longMax:
+                    #create buy order
+                    order = [CallorPut, expirationDay, strike, marketAskPrice, iDelta, 100*AskimpliedVol, volatility, "Buy"]
+                    #print("Market ask Price: ",marketAskPrice," and my bid Price: ", MyBidPrice)
+                    #print("My implied vol: ", AskimpliedVol)
+                    BuyList.append(order)
+                    BuyTimes.append(int(times[i]))
+                    #print("Buy order")
+                    currentPutPosition += 1
+                    if AskimpliedVol > volatility:
+                        print("WHY ARE YOU BUYING")
+            else:
+                pass
+        ledger = TradeLedger(BuyList, SellList, BuyTimes, SellTimes)
 
-    profit, MoneyMakers, MoneyLosers = ProfitLoss(BuyList, SellList, yearStamp)
+    profit, MoneyMakers, MoneyLosers = LedgerProfit(ledger, inputYear, inputMonth, False)
     #print("Overall P+L is: ", profit)
 
     return profit, MoneyMakers, MoneyLosers
 
 def ImpliedVolTrading(inputYear, inputMonth, spread, longMax, shortMax, deltaTrading):
-    inputMonthList = ["01","02","03","04","05","06","07","08","09","10","11","12"]
-    if inputMonth == "01":
-        preMonthYear = str(int(inputYear)-1)
-        preMonth = "12"
-    else:
-        index = inputMonthList.index(inputMonth)
-        preMonth = inputMonthList[index-1]
-        preMonthYear = inputYear
-    yearStamp = f"{inputYear}-{inputMonth}-01"
-    preMonthStamp = f"{preMonthYear}-{preMonth}-01"
+    yearStamp, preMonthStamp = MonthStamps(inputYear, inputMonth)
         
-    file_path = f"datasets/Formatted {inputYear}/{inputMonth}.csv"
-    optionData = pd.read_csv(file_path)
+    optionData = LoadOptionData(inputYear, inputMonth, PricingColumns)
+    volState = {}
     volDataByExpiry = []
-    options = []
     BuyList = []
     SellList = []
     currentCallPosition = 0
     currentPutPosition = 0
-    i = 0
     dayVolData = FetchData("BTC/USDT", "1d", 30, preMonthStamp)
     HistVol = HistoricalVolCalc(dayVolData["Close"], dayVolData["Timestamp"])
-    DayPrice = FetchData("BTC/USDT", "5m", 500, yearStamp)
-    for i in range(len(optionData)):
-
-        formattedTimestamp = TimeMinPeriods(optionData["timestamp"][i])
-
-
-        strike = float(optionData.iloc[i]["strike_price"])
-        expiration = (float(optionData.iloc[i]["expiration"][8:10]) - 1)/365
-        iDelta = float(optionData.iloc[i]["delta"])
-        #iBidIV = float(optionData.iloc[i]["bid_iv"])
-        #iAskIV = float(optionData.iloc[i]["ask_iv"])         
-
-        expirationDay = (int(optionData.iloc[i]["expiration"][8:10]) - 1)
-        CallorPut = optionData.iloc[i]["type"]
-        spot = float(DayPrice.iloc[formattedTimestamp]["Close"])
-        marketBidPrice = optionData.iloc[i]["bid_price"] * spot
-        marketAskPrice = optionData.iloc[i]["ask_price"] * spot
+    spots = QuoteSpots(optionData, yearStamp)
+    if Engine == "Columnar":
+        ledger, volDataByExpiry = ImpliedVolColumns(optionData, spots, HistVol, spread, longMax, shortMax)
+    else:
+        if not UnitFills():
+            raise ValueError("FillModel 'Depth' and the position limits need Engine = 'Columnar'.")
+        times = QuoteTimes(optionData)
+        BuyTimes = []
+        SellTimes = []
+        for i in range(len(times)):
+
+            strike = float(optionData["strike_price"][i])
+            expiration = float(optionData["yearFraction"][i])
+            iDelta = float(optionData["delta"][i])
+            iBidIV = float(optionData["bid_iv"][i])
+            iAskIV = float(optionData["ask_iv"][i])
+            iMarkIV = float(optionData["mark_iv"][i])
+
+            expirationDay = int(optionData["expirationDay"][i])
+            CallorPut = str(optionData["type"][i])
+            spot = float(spots[i])
+            marketBidPrice = float(optionData["bid_price"][i]) * spot
+            marketAskPrice = float(optionData["ask_price"][i]) * spot
 
 
         
-        if expiration < 0.0028 or math.isnan(marketBidPrice) or math.isnan(marketAskPrice):
-            continue #to skip same day expirations
+            if expiration < 0.0028 or math.isnan(marketBidPrice) or math.isnan(marketAskPrice):
+                continue #to skip same day expirations
         
 
-        AskimpliedVol = ImpliedVolatility(marketAskPrice, spot, strike, expiration, HistVol, RFR, CallorPut)
-        BidimpliedVol = ImpliedVolatility(marketBidPrice, spot, strike, expiration, HistVol, RFR, CallorPut)
-        if AskimpliedVol == "Error" or BidimpliedVol == "Error":
-            continue
-        MarketImpliedVol = (AskimpliedVol + BidimpliedVol)/2
-        #adjusting implied volatility
-        found = False
-        for entry in volDataByExpiry:
-            if entry[0] == expirationDay:
-                entry[2] += 1
-                volatility = ((entry[2]-1)/entry[2]) * entry[1] + (1/entry[2]) * MarketImpliedVol
-                entry[1] = volatility
-                found = True
-                break
-        if not found:
-            volatility = HistVol * MarketImpliedVol
-            volDataByExpiry.append([expirationDay, volatility, 1])
+            AskimpliedVol = ImpliedVolatilityFromSource(marketAskPrice, iAskIV, iMarkIV, spot, strike, expiration, HistVol, RFR, CallorPut)
+            BidimpliedVol = ImpliedVolatilityFromSource(marketBidPrice, iBidIV, iMarkIV, spot, strike, expiration, HistVol, RFR, CallorPut)
+            if AskimpliedVol == "Error" or BidimpliedVol == "Error":
+                continue
+            MarketImpliedVol = (AskimpliedVol + BidimpliedVol)/2
+            #adjusting implied volatility
+            volatility = UpdateVolState(volState, expirationDay, strike, MarketImpliedVol, HistVol, int(times[i]))
                 
         
 
-        #print("My Black Scholes Inputs: \n Strike: ", strike, "\n Exp", expiration, "\n Vol: ", volatility)
+            #print("My Black Scholes Inputs: \n Strike: ", strike, "\n Exp", expiration, "\n Vol: ", volatility)
         
-        if CallorPut == "call":
-            MyBidPrice, MyAskPrice = BidAsk(spot, strike, expiration, volatility, RFR, CallorPut, spread)
-            MyOptionPrice = BlackScholes(spot, strike, expiration, volatility, RFR, CallorPut)
-        else:
             MyBidPrice, MyAskPrice = BidAsk(spot, strike, expiration, volatility, RFR, CallorPut, spread)
-            callPrice = BlackScholes(spot, strike, expiration, volatility, RFR, CallorPut)
-            MyOptionPrice = PutCallParity(callPrice,spot, strike, expiration, RFR, "put")
 
         
-        if CallorPut == "call":
-            if marketBidPrice > MyAskPrice and currentCallPosition > -shortMax:
-                order = [CallorPut, expirationDay, strike, marketBidPrice, iDelta, 100*BidimpliedVol, volatility, "Sell"]
-                #create sell order
-                SellList.append(order)
-                #print("Market Bid Price: ",marketBidPrice," and my Ask Price: ", MyAskPrice)
-                #print("Sell order")
-                currentCallPosition -= 1
-            elif marketAskPrice < MyBidPrice and currentCallPosition < longMax:
-                #create buy order
-                order = [CallorPut, expirationDay, strike, marketAskPrice, iDelta, 100*AskimpliedVol, volatility, "Buy"]
-                #print("Market ask Price: ",marketAskPrice," and my bid Price: ", MyBidPrice)
-                #print("My implied vol: ", AskimpliedVol)
-                BuyList.append(order)
-                #print("Buy order")
-                currentCallPosition += 1
-                if AskimpliedVol > volatility:
-                    print("WHY ARE YOU BUYING")
-        elif CallorPut == "put":
-            if marketBidPrice > MyAskPrice and currentPutPosition > -shortMax:
-                order = [CallorPut, expirationDay, strike, marketBidPrice, iDelta, 100*BidimpliedVol, volatility, "Sell"]
-                #create sell order
-                SellList.append(order)
-                #print("Market Bid Price: ",marketBidPrice," and my Ask Price: ", MyAskPrice)
-                #print("Sell order")
-                currentPutPosition -= 1
-            elif marketAskPrice < MyBidPrice and currentPutPosition < longMax:
-                #create buy order
-                order = [CallorPut, expirationDay, strike, marketAskPrice, iDelta, 100*AskimpliedVol, volatility, "Buy"]
-                #print("Market ask Price: ",marketAskPrice," and my bid Price: ", MyBidPrice)
-                #print("My implied vol: ", AskimpliedVol)
-                BuyList.append(order)
-                #print("Buy order")
-                currentPutPosition += 1
-                if AskimpliedVol > volatility:
-                    print("WHY ARE YOU BUYING")
-        else:
-            pass
-    #("Buy list pre-delta trading: ", BuyList[0])
-    if deltaTrading == True:
-        deltaProfit = MakeDeltaNeutral(BuyList,SellList, inputYear, inputMonth)
-    else:
-        deltaProfit = 0
-        
-        
-    
-    #print("Buy list: ", BuyList[0])
-    optionProfit, MoneyMakers, MoneyLosers = ProfitLoss(BuyList, SellList, yearStamp)
-    profit = optionProfit + deltaProfit
+            if CallorPut == "call":
+                if marketBidPrice > MyAskPrice and currentCallPosition > -shortMax:
+                    order = [CallorPut, expirationDay, strike, marketBidPrice, iDelta, 100*BidimpliedVol, volatility, "Sell"]
+                    #create sell order
+                    SellList.append(order)
+                    SellTimes.append(int(times[i]))
+                    #print("Market Bid Price: ",marketBidPrice," and my Ask Price: ", MyAskPrice)
+                    #print("Sell order")
+                    currentCallPosition -= 1
+                elif marketAskPrice < MyBidPrice and currentCallPosition < longMax:
+                    #create buy order
+                    order = [CallorPut, expirationDay, strike, marketAskPrice, iDelta, 100*AskimpliedVol, volatility, "Buy"]
+                    #print("Market ask Price: ",marketAskPrice," and my bid Price: ", MyBidPrice)
+                    #print("My implied vol: ", AskimpliedVol)
+                    BuyList.append(order)
+                    BuyTimes.append(int(times[i]))
+                    #print("Buy order")
+                    currentCallPosition += 1
+                    if AskimpliedVol > volatility:
+                        print("WHY ARE YOU BUYING")
+            elif CallorPut == "put":
+                if marketBidPrice > MyAskPrice and currentPutPosition > -shortMax:
+                    order = [CallorPut, expirationDay, strike, marketBidPrice, iDelta, 100*BidimpliedVol, volatility, "Sell"]
+                    #create sell order
+                    SellList.append(order)
+                    SellTimes.append(int(times[i]))
+                    #print("Market Bid Price: ",marketBidPrice," and my Ask Price: ", MyAskPrice)
+                    #print("Sell order")
+                    currentPutPosition -= 1
+                elif marketAskPrice < MyBidPrice and currentPutPosition < longMax:
+                    #create buy order
+                    order = [CallorPut, expirationDay, strike, marketAskPrice, iDelta, 100*AskimpliedVol, volatility, "Buy"]
+                    #print("Market ask Price: ",marketAskPrice," and my bid Price: ", MyBidPrice)
+                    #print("My implied vol: ", AskimpliedVol)
+                    BuyList.append(order)
+                    BuyTimes.append(int(times[i]))
+                    #print("Buy order")
+                    currentPutPosition += 1
+                    if AskimpliedVol > volatility:
+                        print("WHY ARE YOU BUYING")
+            else:
+                pass
+        volDataByExpiry = list(volState.values())
+        ledger = TradeLedger(BuyList, SellList, BuyTimes, SellTimes)
+
+    profit, MoneyMakers, MoneyLosers = LedgerProfit(ledger, inputYear, inputMonth, deltaTrading)
     
     print("Overall P+L is: ", profit)
     #print(f"Vol data by expiry: {volDataByExpiry}")
     
     return profit, MoneyMakers, MoneyLosers, volDataByExpiry
 
+def SurfaceVolTrading(inputYear, inputMonth, spread, longMax, shortMax, deltaTrading):
+    #Trades each quote against the vol surface fitted to the month's earlier snapshots, always on the columnar engine
+    yearStamp, preMonthStamp = MonthStamps(inputYear, inputMonth)
+    optionData = LoadOptionData(inputYear, inputMonth, PricingColumns)
+    dayVolData = FetchData("BTC/USDT", "1d", 30, preMonthStamp)
+    HistVol = HistoricalVolCalc(dayVolData["Close"], dayVolData["Timestamp"])
+    columns = ColumnImpliedVols(OptionColumns(optionData, QuoteSpots(optionData, yearStamp)), HistVol)
+    volatility, surface = SurfaceColumnVols(columns)
+    MyBidPrice, MyAskPrice = ColumnQuotes(columns, volatility, spread)
+    ledger = PlaceOrders(columns, volatility, MyBidPrice, MyAskPrice, longMax, shortMax)
+    profit, MoneyMakers, MoneyLosers = LedgerProfit(ledger, inputYear, inputMonth, deltaTrading)
+    print("Overall P+L is: ", profit)
+
+    return profit, MoneyMakers, MoneyLosers, surface
+
 def GroupByExpiration(inputList):
     expiration_groups = {}
     for entry in inputList:
@@ -420,23 +1392,133 @@ def GroupByExpiration(inputList):
     return expiration_groups
 
 def DeltaCalc(option_type, spot_price, strike_price, time_to_expiry, risk_free_rate, volatility):
-    time_to_expiry = time_to_expiry/365
+    if option_type != "call" and option_type != "put":
+        raise ValueError("Invalid option type. Must be 'call' or 'put'.")
 
-    d1 = (math.log(spot_price / strike_price) + (risk_free_rate + 0.5 * volatility ** 2) * time_to_expiry) / (volatility * math.sqrt(time_to_expiry))
-    
-    if option_type == 'call':
-        delta = math.exp(-risk_free_rate * time_to_expiry) * norm.cdf(d1)
-    elif option_type == 'put':
-        delta = -math.exp(-risk_free_rate * time_to_expiry) * norm.cdf(-d1)
+    return DeltaColumns(option_type == "call", spot_price, strike_price, time_to_expiry, risk_free_rate, volatility)
+
+
+def DeltaColumns(isCall, spot_price, strike_price, time_to_expiry, risk_free_rate, volatility):
+    #DeltaCalc over whole arrays of options and prices, time_to_expiry in days like DeltaCalc
+    return BlackScholesColumns(spot_price, strike_price, time_to_expiry/365, volatility, risk_free_rate, isCall)[1]
+
+def LedgerPositions(ledger):
+    #The fields of a ledger the hedging engine needs, vol is the one HedgeVol picks
+    return {
+        "isCall": ledger["isCall"],
+        "expiryDay": ledger["expirationDay"].astype(int),
+        "strike": ledger["strike"],
+        "startDelta": ledger["delta"],
+        "vol": ledger["myVol"] if HedgeVol == "Model" else ledger["marketVol"]/100,
+        "sign": ledger["side"] * ledger["size"],
+    }
+
+def DeltaHedgeCash(positions, prices, perDay=1):
+    #Cash from delta hedging every position at prices, one rebalance per price and perDay prices a day
+    #The hedge is put on at prices[0], rebalanced at each price before the expiry day and taken off at its first price
+    #Works on a prices x positions delta matrix, a block of positions at a time to keep memory bounded
+    #Deltas use the days to expiry at the trade, like the daily loops in MakeDeltaNeutral
+    #Returns each position's hedge cash and last hedge delta
+    cash = np.empty(len(positions["expiryDay"]))
+    lastDelta = np.empty(len(positions["expiryDay"]))
+    bars = np.arange(len(prices))[:, None]
+    for block in range(0, len(cash), HedgeBlock):
+        part = slice(block, block + HedgeBlock)
+        expiryDay = positions["expiryDay"][part]
+        expiry = expiryDay * perDay
+        startDelta = positions["startDelta"][part]
+        delta = positions["sign"][part] * DeltaColumns(positions["isCall"][part], prices[:, None], positions["strike"][part], expiryDay, RFR, positions["vol"][part])
+        delta = np.where(bars < expiry, delta, 0)
+        held = np.vstack([np.zeros((1, len(expiry))), delta[:-1]])
+        #an option expiring on the first day is closed out at the delta it was traded at
+        held[0] = np.where(expiry == 0, startDelta, 0)
+        cash[part] = ((delta - held) * prices[:, None]).sum(axis=0)
+        lastDelta[part] = np.where(expiry == 0, startDelta, delta[np.clip(expiry-1, 0, len(prices)-1), np.arange(len(expiry))])
+
+    return cash, lastDelta
+
+def DeltaBandHedgeCash(positions, prices, perDay, band):
+    #Like DeltaHedgeCash but only rebalancing when the hedge is more than band away from the position's delta
+    #Whether a position trades depends on its last hedge, so this steps through the prices, all positions at once
+    cash = np.empty(len(positions["expiryDay"]))
+    lastDelta = np.empty(len(positions["expiryDay"]))
+    for block in range(0, len(cash), HedgeBlock):
+        part = slice(block, block + HedgeBlock)
+        expiryDay = positions["expiryDay"][part]
+        expiry = expiryDay * perDay
+        startDelta = positions["startDelta"][part]
+        delta = positions["sign"][part] * DeltaColumns(positions["isCall"][part], prices[:, None], positions["strike"][part], expiryDay, RFR, positions["vol"][part])
+        held = np.where(expiry == 0, startDelta, 0)
+        blockCash = np.zeros(len(expiry))
+        blockLast = held.copy()
+        for bar in range(len(prices)):
+            live = bar < expiry
+            rebalance = live & ((bar == 0) | (np.abs(delta[bar] - held) > band))
+            move = np.where(bar == expiry, -held, np.where(rebalance, delta[bar] - held, 0))
+            blockCash += move * prices[bar]
+            blockLast = np.where(live, held + move, blockLast)
+            held = held + move
+        cash[part] = blockCash
+        lastDelta[part] = blockLast
+
+    return cash, lastDelta
+
+def HedgePrices(year, month):
+    #Opening prices to rebalance at from the start of the month for HedgeFrequency, and how many there are a day
+    timeframe = "5m" if HedgeFrequency == "band" else HedgeFrequency
+    perDay = TimeframeMs("1d") // TimeframeMs(timeframe)
+    bars = FetchData("BTC/USDT", timeframe, 32 * perDay, f"{year}-{month}-01")
+    return bars["Open"].to_numpy(dtype=float), perDay
+
+def LedgerHedgeCash(ledger, prices, perDay):
+    #Vectorised MakeDeltaNeutral, rebalancing at each of prices
+    #Returns the hedge P&L of the positions closed by the end of prices, and each trade's hedge cash and last delta
+    cash = np.zeros(len(ledger))
+    lastDelta = np.zeros(len(ledger))
+    deltaProfit = 0
+    #bought then sold, each hedged on its own and added up in the order the loops close positions, by expiry day then ledger order
+    for side in (1, -1):
+        rows = np.flatnonzero(ledger["side"] == side)
+        if len(rows) == 0:
+            continue
+        positions = LedgerPositions(ledger[rows])
+        if HedgeFrequency == "band":
+            cash[rows], lastDelta[rows] = DeltaBandHedgeCash(positions, prices, perDay, HedgeBand)
+        else:
+            cash[rows], lastDelta[rows] = DeltaHedgeCash(positions, prices, perDay)
+        order = np.argsort(positions["expiryDay"], kind="stable")
+        for entryCash in cash[rows][order][positions["expiryDay"][order] * perDay < len(prices)].tolist():
+            deltaProfit += entryCash
+
+    return deltaProfit, cash, lastDelta
+
+def HedgeLedger(ledger, year, month):
+    #Delta hedges every trade, returns the hedge P&L and a copy of the ledger with hedgeDelta and hedgeCash filled in
+    ledger = ledger.copy()
+    if Engine == "Columnar" or HedgeFrequency != "1d" or (ledger["size"] != 1).any():
+        prices, perDay = HedgePrices(year, month)
+        deltaProfit, ledger["hedgeCash"], ledger["hedgeDelta"] = LedgerHedgeCash(ledger, prices, perDay)
     else:
-        raise ValueError("Invalid option type. Must be 'call' or 'put'.")
-    
-    return delta
+        #the original daily loops, on order lists of one contract each
+        BuyList, SellList = LedgerOrders(ledger)
+        deltaProfit = MakeDeltaNeutral(BuyList, SellList, year, month)
+        ledger["hedgeDelta"] = [entry[4] for entry in BuyList + SellList]
+        ledger["hedgeCash"] = [entry[8] for entry in BuyList + SellList]
 
+    return deltaProfit, ledger
 
 def MakeDeltaNeutral(BuyList, SellList, year, month):
+    if Engine == "Columnar" or HedgeFrequency != "1d":
+        #order lists go through the ledger hedging and get its results written back like the loops would
+        deltaProfit, ledger = HedgeLedger(TradeLedger(BuyList, SellList), year, month)
+        for entry, hedgeDelta, hedgeCash in zip(BuyList + SellList, ledger["hedgeDelta"].tolist(), ledger["hedgeCash"].tolist()):
+            entry[4] = hedgeDelta
+            entry.append(hedgeCash)
+        return deltaProfit
     dailyPrices = FetchData("BTC/USDT", "1d", 32, f"{year}-{month}-01")
     deltaProfit = 0
+    #entry[6] is the vol we priced with, entry[5] is the market implied vol from the solver in percent
+    volIndex, volScale = (6, 1) if HedgeVol == "Model" else (5, 100)
     expBuyList = GroupByExpiration(BuyList)
     for key in expBuyList:
         for entry in expBuyList[key]:
@@ -487,7 +1569,7 @@ def MakeDeltaNeutral(BuyList, SellList, year, month):
                 for entry in expBuyList[key]:
                     if i > 0:
                         old_delta = entry[4]
-                        new_delta = DeltaCalc(entry[0], dailyPrices["Open"][i], entry[2], entry[1], RFR, entry[6])
+                        new_delta = DeltaCalc(entry[0], dailyPrices["Open"][i], entry[2], entry[1], RFR, entry[volIndex]/volScale)
                         change_delta = new_delta - old_delta
                         Money_change = change_delta * dailyPrices["Open"][i]
                         entry[8] += Money_change
@@ -497,7 +1579,7 @@ def MakeDeltaNeutral(BuyList, SellList, year, month):
                             #print(f"It is day {i}, the change in delta is {change_delta}, delta is now {new_delta} so our change in bank money is {Money_change}, and our total money from this trade is {entry[8]}")
                         #print(f"With new price, current position is now worth {current_position}")
                     else:
-                        delta = DeltaCalc(entry[0], dailyPrices["Open"][i], entry[2], entry[1], RFR, entry[6])
+                        delta = DeltaCalc(entry[0], dailyPrices["Open"][i], entry[2], entry[1], RFR, entry[volIndex]/volScale)
                         entry[4] = delta
                         entry[8] = delta*dailyPrices["Open"][i] #e.g. assume delta 0.5, then sell 0.5 bitcoin, so bank balance positive
                         #print(f"Price of bitcoin is", dailyPrices["Open"][i], f"Delta is {delta}, i = 0, so we are selling (buying if -) {positionWanted} worth of bitcoin. . We are currently {entry[8]} in terms of pandl.")
@@ -535,7 +1617,7 @@ def MakeDeltaNeutral(BuyList, SellList, year, month):
                 for entry in expSellList[key]:
                     if i > 0:
                         old_delta = entry[4]
-                        new_delta = -DeltaCalc(entry[0], dailyPrices["Open"][i], entry[2], entry[1], RFR, entry[6])
+                        new_delta = -DeltaCalc(entry[0], dailyPrices["Open"][i], entry[2], entry[1], RFR, entry[volIndex]/volScale)
                         change_delta = new_delta - old_delta
                         Money_change = change_delta * dailyPrices["Open"][i]
                         entry[8] += Money_change
@@ -545,7 +1627,7 @@ def MakeDeltaNeutral(BuyList, SellList, year, month):
                         
                         
                     else:
-                        delta = DeltaCalc(entry[0], dailyPrices["Open"][i], entry[2], entry[1], RFR, entry[6])
+                        delta = DeltaCalc(entry[0], dailyPrices["Open"][i], entry[2], entry[1], RFR, entry[volIndex]/volScale)
                         entry[4] = -delta
                         entry[8] = -delta*dailyPrices["Open"][i] #e.g. assmume delta = 0.5, we sold it, so we have -0.5 delta, so buy BTC to neutralise, so negative bank
                         #print(f"Price of bitcoin is", dailyPrices["Open"][i], f" i = 0 so we are buying {positionWanted} worth of bitcoin. Delta is {delta}. We are currently down {entry[8]} in terms of pandl.")
@@ -565,114 +1647,953 @@ def MakeDeltaNeutral(BuyList, SellList, year, month):
     
 
 def ProfitLoss(BuyList, SellList, month):
-    profit = 0
+    #List version of SettleLedger, appends each trade's profit to its entry and splits them into MoneyMakers and MoneyLosers
+    #Entries that are neither a call nor a put are left out, as before
+    BuyList = [item for item in BuyList if item[0] in ("call", "put")]
+    SellList = [item for item in SellList if item[0] in ("call", "put")]
+    profit, ledger = SettleLedger(TradeLedger(BuyList, SellList), month)
+    profChange = ledger["profit"].tolist()
+    made = (ledger["profit"] >= 0).tolist()
     MoneyMakers = []
     MoneyLosers = []
-    expiryPrice = FetchData("BTC/USDT", "1d", 31, month)
-    for item in BuyList:
-        itemDetails = item
-        expiryDayPrice = expiryPrice["Close"].iloc[(item[1])]
-        if item[0] == "call":
-            if expiryDayPrice > item[2]:
-                profChange = ((expiryDayPrice - item[2]) - item[3])
-                itemDetails.append(profChange)
-                if profChange >= 0:
-                    #made money long call
-                    MoneyMakers.append(itemDetails)
-                    profit += profChange
-                   # print("Made money long call: +", profChange)
-                else:
-                    #lost money long call and exercised
-                    MoneyLosers.append(itemDetails)
-                    profit += profChange
-                    #print("Lost money long call: ", profChange)
-            else:
-                profChange = -item[3]
-                itemDetails.append(profChange)
-                #lost money long call
-                MoneyLosers.append(itemDetails)
-                profit += profChange
-                #print("Lost money long call: ", profChange)
-        elif item[0] == "put":
-            if expiryDayPrice < item[2]:
-                profChange = ((item[2] - expiryDayPrice) - item[3])
-                itemDetails.append(profChange)
-                if profChange >= 0:
-                    #made money long put
-                    MoneyMakers.append(itemDetails)
-                    #print("Exercised Put: ", profChange)
-                    profit += profChange
-                else:
-                    #lost money and exercised long put
-                    MoneyLosers.append(itemDetails)
-                    #print("Exercised Put: ", profChange)
-                    profit += profChange
-                    
-            else:
-                profChange = -item[3]
-                itemDetails.append(profChange)
-                #lost money long put
-                MoneyLosers.append(itemDetails)
-                #print("Lost money long Put: ", profChange)
-                profit += profChange
-        #print("Price on expiry day was: ", expiryDayPrice, " and details: ", item)
-        #print("Profit = ", profit)
-
-    for item in SellList:
-        itemDetails = item
-        expiryDayPrice = expiryPrice["Close"].iloc[(item[1])]
-        if item[0] == "call":
-            if expiryDayPrice > item[2]:
-                profChange = -((expiryDayPrice - item[2]) - item[3])
-                itemDetails.append(profChange)
-                if profChange < 0:
-                    #lost money short call
-                    profit += profChange
-                    #print("Lost money short call : ", profChange)
-                    MoneyLosers.append(itemDetails)
-                else:
-                    #made money after expiration short call
-                    profit += profChange
-                   # print("A short call was exercised, we made : ", profChange)
-                    MoneyMakers.append(itemDetails)
-                    
-            else:
-                #made money short call
-                profChange = item[3]
-                itemDetails.append(profChange)
-                profit += profChange
-                #print("Made money short call: ", profChange)
-                MoneyMakers.append(itemDetails)
-        elif item[0] == "put":
-            if expiryDayPrice < item[2]:
-                profChange = -((item[2] - expiryDayPrice) - item[3])
-                itemDetails.append(profChange)
-                if profChange < 0:
-                    #lost money short put
-                    #print("A short put was exercised: ", profChange)
-                    profit += profChange
-                    MoneyLosers.append(itemDetails)
-                else:
-                    #made money after having to exercise a short put
-                    #print("A short put was exercised, we made: ", profChange)
-                    profit += profChange
-                    MoneyMakers.append(itemDetails)
-            else:
-                profChange = item[3]
-                itemDetails.append(profChange)
-                #made money short put
-                #print("Made money short put: ", profChange) 
-                profit += profChange
-                MoneyMakers.append(itemDetails)
-        #print("Price on expiry day was: ", expiryDayPrice, " and details: ", item)
-        #print("Profit = ", profit)
-    
-    
+    for itemDetails, change, maker in zip(BuyList + SellList, profChange, made):
+        itemDetails.append(change)
+        if maker:
+            MoneyMakers.append(itemDetails)
+        else:
+            MoneyLosers.append(itemDetails)
 
     return profit, MoneyMakers, MoneyLosers
 
 
-def ProfitData(spread, longPositionMax, shortPositionMax, TradeType, deltaTrading):
+def EquityPrices(yearStamp):
+    #Closes to mark at, one per EquityTimeframe bar over the month, with the time each bar closed and the month's first bar time
+    bars = FetchData("BTC/USDT", EquityTimeframe, pd.Timestamp(yearStamp).days_in_month * TimeframeMs("1d") // TimeframeMs(EquityTimeframe), yearStamp)
+    barTimes = BarTimes(bars)
+    return bars["Close"].to_numpy(dtype=float), barTimes + TimeframeMs(EquityTimeframe), barTimes[0]
+
+def ExpiryVolAt(volDataByExpiry, expirationDay, strike, times):
+    #Vol state of each expiry (and strike bucket) as of each time in ms, from the history UpdateVolState keeps
+    #NaN before the expiry's first update
+    history = VolHistory(volDataByExpiry).dropna(subset=["time"])
+    bucket = np.full(np.shape(strike), -1) if VolStrikeBucket is None else (np.asarray(strike) // VolStrikeBucket).astype(np.int64)
+    historyBucket = history["strikeBucket"].fillna(-1).to_numpy(dtype=np.int64)
+    groups, group = np.unique(history["expirationDay"].to_numpy(dtype=np.int64) * (1 << 20) + historyBucket, return_inverse=True)
+    key = group.astype(np.int64) * (1 << 42) + history["time"].to_numpy(dtype=np.int64)
+    order = np.argsort(key, kind="stable")
+    key, vols = key[order], history["vol"].to_numpy(dtype=float)[order]
+
+    query = np.asarray(expirationDay, dtype=np.int64) * (1 << 20) + bucket
+    queryGroup = np.searchsorted(groups, query)
+    known = (queryGroup < len(groups)) & (groups[np.minimum(queryGroup, len(groups) - 1)] == query)
+    found = np.searchsorted(key, queryGroup.astype(np.int64) * (1 << 42) + np.asarray(times, dtype=np.int64), side="right") - 1
+    valid = known & (found >= 0) & (key[np.maximum(found, 0)] >> 42 == queryGroup)
+    return np.where(valid, vols[np.maximum(found, 0)] if len(vols) > 0 else np.nan, np.nan)
+
+def MarkVols(ledger, markTimes, markPrices, TradeType, volData, yearStamp):
+    #Vol to mark each trade at at each mark, marks x trades
+    #MarkVol "State" reads the model's vol as of the mark, the surface, the expiry's vol state or the rolling hist vol,
+    #"Market" the exchange's mark_iv on the option's latest quote from the chain index,
+    #and both fall back to the trade's own vol where there's nothing yet. "Trade" always uses the trade's own vol
+    tradeVol = np.broadcast_to(LedgerPositions(ledger)["vol"], (len(markTimes), len(ledger)))
+    if MarkVol == "Trade":
+        return tradeVol
+    elif MarkVol != "State" and MarkVol != "Market":
+        raise ValueError("Invalid MarkVol. Must be 'State', 'Market' or 'Trade'.")
+    times = np.broadcast_to(markTimes[:, None], tradeVol.shape)
+    if MarkVol == "Market":
+        index = ChainIndex(yearStamp[:4], yearStamp[5:7])
+        instruments = np.broadcast_to(ChainInstruments(index, ledger["expirationDay"], ledger["strike"], ledger["isCall"]), tradeVol.shape)
+        rows = np.where(instruments >= 0, ChainRowsAsOf(index, np.maximum(instruments, 0), times * 1000), -1)
+        state = np.where(rows >= 0, ExchangeImpliedVols(np.asarray(LoadOptionData(yearStamp[:4], yearStamp[5:7], ["mark_iv"])["mark_iv"])[np.maximum(rows, 0)]), np.nan)
+    elif TradeType == "Surface":
+        state = SurfaceVol(volData, np.broadcast_to(ledger["strike"], tradeVol.shape).ravel(), np.broadcast_to(ledger["expirationDay"], tradeVol.shape).ravel(),
+                           times.ravel(), np.broadcast_to(markPrices[:, None], tradeVol.shape).ravel()).reshape(tradeVol.shape)
+    elif TradeType == "Implied":
+        state = ExpiryVolAt(volData, np.broadcast_to(ledger["expirationDay"], tradeVol.shape), np.broadcast_to(ledger["strike"], tradeVol.shape), times)
+    elif HistVolEstimator != "Month":
+        state = HistVolAt(times)
+    else:
+        return tradeVol
+    return np.where(np.isnan(state), tradeVol, state)
+
+def LedgerOptionMarks(ledger, markPrices, markTimes, monthStart, yearStamp, TradeType, volData):
+    #P&L of the month's options at each mark, each trade's model value less what was paid for it (the other way round if sold)
+    #Counted from the trade's time, and worth its expiry payoff once its expiry day has closed like in SettleLedger
+    dayMs = TimeframeMs("1d")
+    expiryClose = FetchData("BTC/USDT", "1d", 31, yearStamp)["Close"].to_numpy(dtype=float)
+    daysGone = (markTimes - monthStart) / dayMs
+    value = np.zeros(len(markTimes))
+    for block in range(0, len(ledger), HedgeBlock):
+        trades = ledger[block:block + HedgeBlock]
+        vol = MarkVols(trades, markTimes, markPrices, TradeType, volData, yearStamp)
+        timeLeft = np.maximum(trades["expirationDay"] - daysGone[:, None], 0)/365
+        price = BlackScholesColumns(markPrices[:, None], trades["strike"], timeLeft, vol, RFR, trades["isCall"])[0]
+        expiryDayPrice = expiryClose[trades["expirationDay"]]
+        payoff = np.where(trades["isCall"], np.maximum(expiryDayPrice - trades["strike"], 0), np.maximum(trades["strike"] - expiryDayPrice, 0))
+        settled = markTimes[:, None] >= monthStart + (trades["expirationDay"].astype(np.int64) + 1) * dayMs
+        price = np.where(settled, payoff, price)
+        opened = trades["time"] < markTimes[:, None]
+        value += np.where(opened, trades["side"] * trades["size"] * (price - trades["price"]), 0).sum(axis=1)
+
+    return value
+
+def HedgeHoldings(positions, prices, perDay, part):
+    #Hedge held after each rebalance at prices (prices x positions) for a block of positions, and what was held before the first
+    #Rebalances the same way as DeltaHedgeCash, or DeltaBandHedgeCash for HedgeFrequency "band"
+    expiryDay = positions["expiryDay"][part]
+    expiry = expiryDay * perDay
+    opening = np.where(expiry == 0, positions["startDelta"][part], 0)
+    delta = positions["sign"][part] * DeltaColumns(positions["isCall"][part], prices[:, None], positions["strike"][part], expiryDay, RFR, positions["vol"][part])
+    if HedgeFrequency != "band":
+        return opening, np.where(np.arange(len(prices))[:, None] < expiry, delta, 0)
+    held = np.empty_like(delta)
+    current = opening
+    for bar in range(len(prices)):
+        rebalance = (bar < expiry) & ((bar == 0) | (np.abs(delta[bar] - current) > HedgeBand))
+        current = np.where(bar == expiry, 0, np.where(rebalance, delta[bar], current))
+        held[bar] = current
+    return opening, held
+
+def LedgerHedgeMarks(ledger, prices, perDay, markBars, markPrices):
+    #Value of the delta hedges at each mark, the hedge cash up to the mark's last rebalance plus closing what's still held at the mark price
+    #Returns it summed over the ledger, and the hedge turnover, the notional of every rebalance
+    positions = LedgerPositions(ledger)
+    value = np.zeros(len(markBars))
+    turnover = 0.0
+    markBars = np.clip(markBars, 0, len(prices) - 1)
+    for block in range(0, len(ledger), HedgeBlock):
+        part = slice(block, block + HedgeBlock)
+        opening, held = HedgeHoldings(positions, prices, perDay, part)
+        moves = np.diff(held, axis=0, prepend=opening[None, :])
+        cash = np.cumsum((moves * prices[:, None]).sum(axis=1))
+        value += cash[markBars] - held[markBars].sum(axis=1) * markPrices
+        turnover += float((np.abs(moves) * prices[:, None]).sum())
+
+    return value, turnover
+
+def Drawdown(equity):
+    #How far the equity is below its highest point so far, counting the flat start
+    equity = np.asarray(equity, dtype=float)
+    return equity - np.maximum.accumulate(np.maximum(equity, 0))
+
+def MonthEquity(year, month, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading):
+    #Mark to market equity of a month's trades at every EquityTimeframe close, options and hedge inventory marked together
+    #Returns a DataFrame of options, hedge, equity and drawdown indexed by mark time, and the month's turnover
+    profit, MoneyMakers, MoneyLosers, volData = MonthTrading(year, month, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading)
+    ledger = np.concatenate([MoneyMakers, MoneyLosers])
+    yearStamp = f"{year}-{month}-01"
+    markPrices, markTimes, monthStart = EquityPrices(yearStamp)
+    options = LedgerOptionMarks(ledger, markPrices, markTimes, monthStart, yearStamp, TradeType, volData)
+    hedge = np.zeros(len(markTimes))
+    hedgeTurnover = 0.0
+    if TradeType != "Historical" and deltaTrading == True:
+        prices, perDay = HedgePrices(year, month)
+        rebalanceTimes = monthStart + np.arange(len(prices)) * (TimeframeMs("1d") // perDay)
+        hedge, hedgeTurnover = LedgerHedgeMarks(ledger, prices, perDay, BarIndex(markTimes, rebalanceTimes), markPrices)
+
+    equity = options + hedge
+    frame = pd.DataFrame({"options": options, "hedge": hedge, "equity": equity, "drawdown": Drawdown(equity)}, index=pd.to_datetime(markTimes, unit="ms"))
+    turnover = {"trades": len(ledger), "contracts": float(ledger["size"].sum()), "optionTurnover": float((ledger["price"] * ledger["size"]).sum()), "hedgeTurnover": hedgeTurnover}
+    return frame, turnover
+
+def EquityStats(equity, turnover):
+    #Profit, max drawdown, Sharpe and turnover of an equity curve
+    #The Sharpe is of the mark to mark P&L changes, annualised for EquityTimeframe
+    equity = np.asarray(equity, dtype=float)
+    changes = np.diff(equity, prepend=0)
+    std = np.std(changes)
+    return {
+        "profit": equity[-1] if len(equity) > 0 else 0.0,
+        "maxDrawdown": Drawdown(equity).min() if len(equity) > 0 else 0.0,
+        "sharpe": np.mean(changes) / std * np.sqrt(365 * TimeframeMs("1d") / TimeframeMs(EquityTimeframe)) if std > 0 else np.nan,
+        **turnover,
+    }
+
+def EquityCurve(months, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading, executor=None):
+    #Month equity curves for every (year, month) in months joined into one, each month carrying on from where the last finished
+    #Returns the joined curve, a table of each month's stats and the stats of the whole curve, months run like ProfitData's
+    results = MapMonths(MonthEquity, months, (spread, longPositionMax, shortPositionMax, TradeType, deltaTrading), executor)
+    frames = []
+    monthStats = []
+    total = {"trades": 0, "contracts": 0.0, "optionTurnover": 0.0, "hedgeTurnover": 0.0}
+    carried = 0.0
+    for (year, month), (frame, turnover) in zip(months, results):
+        monthStats.append({"year": year, "month": month, **EquityStats(frame["equity"], turnover)})
+        frame = frame.rename(columns={"equity": "monthEquity", "drawdown": "monthDrawdown"})
+        frame.insert(0, "month", month)
+        frame.insert(0, "year", year)
+        frame["equity"] = frame["monthEquity"] + carried
+        frames.append(frame)
+        if len(frame) > 0:
+            carried = frame["equity"].iloc[-1]
+        for name in total:
+            total[name] += turnover[name]
+
+    curve = pd.concat(frames)
+    curve["drawdown"] = Drawdown(curve["equity"])
+    return curve, pd.DataFrame(monthStats), EquityStats(curve["equity"], total)
+
+
+def FileHash(path):
+    #sha256 of a file's contents
+    info = os.stat(path)
+    if (path, info.st_size, info.st_mtime_ns) not in FileHashCache:
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        FileHashCache[(path, info.st_size, info.st_mtime_ns)] = digest.hexdigest()
+    return FileHashCache[(path, info.st_size, info.st_mtime_ns)]
+
+def DatasetHash(inputYear, inputMonth):
+    #Hash of the month's option data, the formatted CSV as that's what the columnar copy is built from,
+    #or the columnar files if there's no CSV, so building the columnar copy never changes a month's key
+    hashes = []
+    folder = ColumnarDataPath(inputYear, inputMonth)
+    if os.path.exists(OptionDataPath(inputYear, inputMonth)):
+        hashes.append(FileHash(OptionDataPath(inputYear, inputMonth)))
+    elif DatasetFormat == "Columnar" and os.path.exists(folder):
+        hashes += [name + FileHash(os.path.join(folder, name)) for name in sorted(os.listdir(folder)) if name.endswith(".npy")]
+    return hashlib.sha256("".join(hashes).encode()).hexdigest()
+
+def PriceSourceVersion():
+    #What the bars come from, with the bar files themselves when they're read from BarFileDir
+    version = [BarSource.__name__, SpotSource, PriceVersion]
+    if BarSource == FileSource and os.path.exists(BarFileDir):
+        version += [(name, FileHash(os.path.join(BarFileDir, name))) for name in sorted(os.listdir(BarFileDir))]
+    return version
+
+def CodeHash():
+    #Hash of this file's functions, so editing them throws the cached results away but changing the variables chosen at the bottom doesn't
+    with open(os.path.abspath(__file__), encoding="utf-8") as file:
+        return hashlib.sha256(file.read().split("#END OF " + "FUNCTIONS")[0].encode()).hexdigest()
+
+def ResultKey(year, month, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading):
+    #Everything a month's result depends on, hashed into the name of its cache file
+    key = [CodeHash(), DatasetHash(year, month), PriceSourceVersion(), year, month, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading,
+           RFR, Engine, IVSolver, VolMax, IVTolerance, HedgeFrequency, HedgeBand, HedgeVol, VolEstimator, VolDecay, VolWindow, VolSeed, VolStrikeBucket,
+           SurfaceBucket, SurfaceSmoothing, HistVolEstimator, HistVolWindow, HistVolTimeframe, HistVolStart, HistVolEnd,
+           IVSource, IVReconcileTolerance, FillModel, FillShare, OrderSize, FillStep, ExpiryLimit, ContractLimit, OpenInterestShare, DeltaLimit, VegaLimit]
+    return hashlib.sha256(repr(key).encode()).hexdigest()
+
+def LoadResult(key):
+    #A cached month result, or None if it isn't cached
+    path = os.path.join(ResultCacheDir, f"{key}.pkl")
+    try:
+        with open(path, "rb") as file:
+            result = pickle.load(file)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+    #touched so eviction sees it as recently used
+    os.utime(path)
+    return result
+
+def StoreResult(key, result):
+    #Saves a month result, then drops the least recently used ones until the cache is under ResultCacheSize bytes
+    os.makedirs(ResultCacheDir, exist_ok=True)
+    path = os.path.join(ResultCacheDir, f"{key}.pkl")
+    with open(path + f"-{os.getpid()}.tmp", "wb") as file:
+        pickle.dump(result, file)
+    os.replace(path + f"-{os.getpid()}.tmp", path)
+
+    entries = []
+    for name in os.listdir(ResultCacheDir):
+        try:
+            info = os.stat(os.path.join(ResultCacheDir, name))
+        except FileNotFoundError:
+            continue
+        if name.endswith(".pkl"):
+            entries.append((info.st_mtime_ns, info.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= ResultCacheSize or name == f"{key}.pkl":
+            break
+        try:
+            os.remove(os.path.join(ResultCacheDir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def CachedMonthTrading(year, month, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading):
+    #The cached (profit, MoneyMakers, MoneyLosers, volDataByExpiry) for a month, or None if it hasn't been run with these settings
+    if ResultCacheDir is None:
+        return None
+    return LoadResult(ResultKey(year, month, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading))
+
+def MonthTrading(year, month, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading):
+    #The TradeType's trading function as (profit, MoneyMakers, MoneyLosers, volDataByExpiry), from the result cache if it's there
+    #For "Surface" the last item is the fitted surface instead of volDataByExpiry
+    result = CachedMonthTrading(year, month, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading)
+    if result is not None:
+        return result
+    if TradeType == "Historical":
+        profit, MoneyMakers, MoneyLosers = HistoricalVolTrading(year, month, spread, longPositionMax, shortPositionMax)
+        result = (profit, MoneyMakers, MoneyLosers, [])
+    elif TradeType == "Surface":
+        result = SurfaceVolTrading(year, month, spread, longPositionMax, shortPositionMax, deltaTrading)
+    else:
+        result = ImpliedVolTrading(year, month, spread, longPositionMax, shortPositionMax, deltaTrading)
+    if ResultCacheDir is not None:
+        StoreResult(ResultKey(year, month, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading), result)
+    return result
+
+def MonthProfit(year, month, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading):
+    #One month's backtest, the unit of work ProfitData hands out
+    profit = 0
+    if TradeType == "Historical" or TradeType == "Implied" or TradeType == "Surface":
+        profit = MonthTrading(year, month, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading)[0]
+    elif TradeType == "DeltaNeutral":
+        #fill
+        pass
+    else:
+        print("Error in Trade type.")
+
+    return profit
+
+def SharedMonth(prices, work, year, month, *args):
+    #work(year, month, *args) for a worker, with the price windows the parent already loaded so the worker never fetches
+    PriceCache.update(prices)
+    return work(year, month, *args)
+
+def MonthPriceWindows(year, month):
+    #The FetchData calls a month's backtest and equity curve make, as (symbol, timeframe, points, start)
+    yearStamp, preMonthStamp = MonthStamps(year, month)
+    windows = [("BTC/USDT", "1d", 30, preMonthStamp), ("BTC/USDT", "1d", 31, yearStamp), ("BTC/USDT", "1d", 32, yearStamp)]
+    equityWindow = ("BTC/USDT", EquityTimeframe, pd.Timestamp(yearStamp).days_in_month * TimeframeMs("1d") // TimeframeMs(EquityTimeframe), yearStamp)
+    if equityWindow not in windows:
+        windows.append(equityWindow)
+    if SpotSource != "Dataset":
+        windows.append(MonthBarsWindow(yearStamp, "5m"))
+    if HistVolEstimator != "Month":
+        windows.append(HistVolWindowArgs())
+    if HedgeFrequency != "1d":
+        timeframe = "5m" if HedgeFrequency == "band" else HedgeFrequency
+        windows.append(("BTC/USDT", timeframe, 32 * TimeframeMs("1d") // TimeframeMs(timeframe), yearStamp))
+    return windows
+
+def MapMonths(work, months, args, executor=None):
+    #work(year, month, *args) for every (year, month) in months, in that order however the workers finish
+    #Runs across Workers processes, or on the executor passed in, when there's more than one worker
+    if executor is None and Workers <= 1:
+        return [work(year, month, *args) for year, month in months]
+
+    #prices are loaded once here and shipped with each month rather than fetched again by every worker
+    prices = {}
+    for year, month in months:
+        for window in MonthPriceWindows(year, month):
+            if window not in prices:
+                prices[window] = FetchData(*window)
+
+    pool = ProcessPoolExecutor(max_workers=Workers) if executor is None else executor
+    try:
+        futures = [pool.submit(SharedMonth, {window: prices[window] for window in MonthPriceWindows(year, month)}, work, year, month, *args)
+                   for year, month in months]
+        return [future.result() for future in futures]
+    finally:
+        if executor is None:
+            pool.shutdown()
+
+def RunMonths(months, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading, executor=None):
+    #Profit for every (year, month) in months, only the months not in the result cache are run
+    args = (spread, longPositionMax, shortPositionMax, TradeType, deltaTrading)
+    profits = {}
+    for year, month in months:
+        result = CachedMonthTrading(year, month, *args)
+        if result is not None:
+            profits[(year, month)] = result[0]
+    missing = [(year, month) for year, month in months if (year, month) not in profits]
+    if len(missing) > 0:
+        profits.update(zip(missing, MapMonths(MonthProfit, missing, args, executor)))
+
+    return [profits[(year, month)] for year, month in months]
+
+def IVReconciliation(year, month):
+    #Where a month's bid and ask implied vols come from with IVSource, as quotes, exchange, solved, missing, disagreed and unsolved counts
+    #with the mean gap between the exchange's vol and the solved one where they disagreed
+    yearStamp, preMonthStamp = MonthStamps(year, month)
+    optionData = LoadOptionData(year, month, PricingColumns)
+    dayVolData = FetchData("BTC/USDT", "1d", 30, preMonthStamp)
+    HistVol = HistoricalVolCalc(dayVolData["Close"], dayVolData["Timestamp"])
+    return SourceImpliedVols(OptionColumns(optionData, QuoteSpots(optionData, yearStamp)), HistVol)[2]
+
+def IVReconciliationTable(months, executor=None):
+    #IVReconciliation for every (year, month) in months as a table, months run like ProfitData's
+    stats = MapMonths(IVReconciliation, months, (), executor)
+    return pd.DataFrame([{"year": year, "month": month, **monthStats} for (year, month), monthStats in zip(months, stats)])
+
+def SweepGrid(spreads, longPositionMaxes, shortPositionMaxes, TradeTypes=("Implied",), deltaTradings=(True,)):
+    #Every combination of the values given, as the (spread, longPositionMax, shortPositionMax, TradeType, deltaTrading) points Sweep takes
+    return [(spread, longMax, shortMax, tradeType, delta) for spread in spreads for longMax in longPositionMaxes
+            for shortMax in shortPositionMaxes for tradeType in TradeTypes for delta in deltaTradings]
+
+def SweepMonthData(year, month):
+    #The part of a month's backtest no sweep parameter changes: solved quotes and the vol each TradeType prices at
+    yearStamp, preMonthStamp = MonthStamps(year, month)
+    optionData = LoadOptionData(year, month, PricingColumns)
+    dayVolData = FetchData("BTC/USDT", "1d", 30, preMonthStamp)
+    HistVol = HistoricalVolCalc(dayVolData["Close"], dayVolData["Timestamp"])
+    columns = ColumnImpliedVols(OptionColumns(optionData, QuoteSpots(optionData, yearStamp)), HistVol)
+    MarketImpliedVol = (columns["AskimpliedVol"] + columns["BidimpliedVol"])/2
+    impliedVolatility, _ = ExpiryVolPath(columns["expirationDay"], MarketImpliedVol, HistVol, columns["strike"], columns["time"])
+    surfaceVolatility, _ = SurfaceColumnVols(columns)
+
+    historicalVolatility = HistVol if HistVolEstimator == "Month" else HistVolAt(columns["time"])
+
+    return {"yearStamp": yearStamp, "columns": columns, "Historical": historicalVolatility, "Implied": impliedVolatility, "Surface": surfaceVolatility}
+
+def SweepMonth(year, month, grid):
+    #Profit for every grid point in one month, solving the month's implied vols once
+    monthData = SweepMonthData(year, month)
+    quotes = {}
+    profits = []
+    for spread, longMax, shortMax, TradeType, deltaTrading in grid:
+        if TradeType not in ("Historical", "Implied", "Surface"):
+            raise ValueError("Invalid TradeType. Must be 'Historical', 'Implied' or 'Surface'.")
+        volatility = monthData[TradeType]
+        #our quotes only depend on the spread, the position limits just change which of them fill
+        if (TradeType, spread) not in quotes:
+            quotes[(TradeType, spread)] = ColumnQuotes(monthData["columns"], volatility, spread)
+        MyBidPrice, MyAskPrice = quotes[(TradeType, spread)]
+        ledger = PlaceOrders(monthData["columns"], volatility, MyBidPrice, MyAskPrice, longMax, shortMax)
+        profit, MoneyMakers, MoneyLosers = LedgerProfit(ledger, year, month, TradeType != "Historical" and deltaTrading == True)
+        profits.append(profit)
+
+    return profits
+
+def Sweep(grid, months, executor=None):
+    #Monthly profit for every (spread, longPositionMax, shortPositionMax, TradeType, deltaTrading) in grid over months
+    #Each month is loaded and solved once and then every grid point is decided against it, months run like ProfitData's
+    #Always uses the columnar pricing whatever Engine is set to
+    grid = [tuple(point) for point in grid]
+    monthProfits = MapMonths(SweepMonth, months, (grid,), executor)
+    rows = [(*point, year, month, profits[n]) for n, point in enumerate(grid) for (year, month), profits in zip(months, monthProfits)]
+
+    return pd.DataFrame(rows, columns=["spread", "longPositionMax", "shortPositionMax", "TradeType", "deltaTrading", "year", "month", "profit"])
+
+def SimulatePaths(spot, vol, steps, perDay, paths, rng):
+    #paths simulated BTC price paths from spot, each of steps moves with perDay moves a day, as a paths x (steps + 1) array
+    #StressModel "GBM" is geometric Brownian motion at vol, "Jump" adds Merton jumps with the drift compensated for them
+    dt = 1 / (365 * perDay)
+    logReturns = (StressDrift - 0.5 * vol**2) * dt + vol * np.sqrt(dt) * rng.standard_normal((paths, steps))
+    if StressModel == "Jump":
+        jumps = rng.poisson(JumpIntensity * dt, (paths, steps))
+        logReturns += jumps * JumpMean + np.sqrt(jumps) * JumpVol * rng.standard_normal((paths, steps)) - JumpIntensity * (np.exp(JumpMean + 0.5 * JumpVol**2) - 1) * dt
+    elif StressModel != "GBM":
+        raise ValueError("Invalid StressModel. Must be 'GBM' or 'Jump'.")
+
+    return spot * np.exp(np.concatenate([np.zeros((paths, 1)), np.cumsum(logReturns, axis=1)], axis=1))
+
+def PathHedgeCash(positions, paths, perDay):
+    #DeltaHedgeCash, or DeltaBandHedgeCash for HedgeFrequency "band", on every path at once
+    #paths is paths x prices like HedgePrices for each path, returns the hedge cash of all the positions added up per path
+    #Positions go in expiry order so at each price only the ones still live, the end of each block, get their deltas worked out
+    order = np.argsort(positions["expiryDay"], kind="stable")
+    positions = {name: column[order] for name, column in positions.items()}
+    cash = np.zeros(len(paths))
+    for block in range(0, len(order), HedgeBlock):
+        part = slice(block, block + HedgeBlock)
+        expiryDay = positions["expiryDay"][part]
+        expiry = expiryDay * perDay
+        isCall, strike, vol, sign = positions["isCall"][part], positions["strike"][part], positions["vol"][part], positions["sign"][part]
+        held = np.repeat(np.where(expiry == 0, positions["startDelta"][part], 0)[None, :], len(paths), axis=0)
+        for bar in range(min(expiry[-1] + 1, paths.shape[1])):
+            price = paths[:, bar, None]
+            #the hedge of anything expiring now is taken off
+            first, live = np.searchsorted(expiry, bar), np.searchsorted(expiry, bar, side="right")
+            if live > first:
+                cash -= (held[:, first:live] * price).sum(axis=1)
+                held[:, first:live] = 0
+            delta = sign[live:] * DeltaColumns(isCall[live:], price, strike[live:], expiryDay[live:], RFR, vol[live:])
+            move = delta - held[:, live:]
+            if HedgeFrequency == "band" and bar > 0:
+                move = np.where(np.abs(move) > HedgeBand, move, 0)
+            cash += (move * price).sum(axis=1)
+            held[:, live:] += move
+
+    return cash
+
+def PathProfits(ledger, paths, perDay, deltaTrading):
+    #Each path's P&L from the ledger's trades, settled at the close of each expiry day on the path and hedged along it if deltaTrading
+    #The close of day e is the path's price at the start of day e + 1
+    days = ledger["expirationDay"].astype(int)
+    expiryPrice = paths[:, (days + 1) * perDay]
+    payoff = np.where(ledger["isCall"], np.maximum(expiryPrice - ledger["strike"], 0), np.maximum(ledger["strike"] - expiryPrice, 0))
+    profit = ((payoff - ledger["price"]) * (ledger["side"] * ledger["size"])).sum(axis=1)
+    if deltaTrading:
+        profit += PathHedgeCash(LedgerPositions(ledger), paths, perDay)
+
+    return profit
+
+def MonthStress(year, month, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading):
+    #The month's actual trades settled and hedged like MakeDeltaNeutral against StressPaths simulated paths, StressChunk paths at a time
+    #Paths start at the month's opening price with StressVol, or the month before's HistVol, and step at HedgeFrequency
+    #Returns the month's actual profit and each path's profit
+    profit, MoneyMakers, MoneyLosers, volData = MonthTrading(year, month, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading)
+    ledger = np.concatenate([MoneyMakers, MoneyLosers])
+    yearStamp, preMonthStamp = MonthStamps(year, month)
+    prices, perDay = HedgePrices(year, month)
+    vol = StressVol
+    if vol is None:
+        dayVolData = FetchData("BTC/USDT", "1d", 30, preMonthStamp)
+        vol = HistoricalVolCalc(dayVolData["Close"], dayVolData["Timestamp"])
+    #seeded by the month so every run, and every worker, simulates the same paths for it
+    rng = np.random.default_rng([StressSeed, int(year), int(month)])
+    steps = pd.Timestamp(yearStamp).days_in_month * perDay
+    hedged = TradeType != "Historical" and deltaTrading == True
+    pathProfit = np.concatenate([PathProfits(ledger, SimulatePaths(prices[0], vol, steps, perDay, min(StressChunk, StressPaths - start), rng), perDay, hedged)
+                                 for start in range(0, StressPaths, StressChunk)])
+
+    return profit, pathProfit
+
+def StressStats(pathProfit):
+    #Mean, spread and tail of a simulated P&L distribution, VaR and expected shortfall as losses at StressLevel
+    pathProfit = np.asarray(pathProfit, dtype=float)
+    cutoff = np.quantile(pathProfit, 1 - StressLevel)
+    return {
+        "mean": pathProfit.mean(),
+        "std": pathProfit.std(),
+        "lossChance": (pathProfit < 0).mean(),
+        "worst": pathProfit.min(),
+        "VaR": -cutoff,
+        "expectedShortfall": -pathProfit[pathProfit <= cutoff].mean(),
+    }
+
+def StressTest(months, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading, executor=None):
+    #MonthStress for every (year, month) in months, run like ProfitData's
+    #Returns a table of each month's actual profit against its simulated P&L, the stats of the whole backtest simulated
+    #StressPaths times (path n of every month added up) and the path profits as a months x paths array
+    results = MapMonths(MonthStress, months, (spread, longPositionMax, shortPositionMax, TradeType, deltaTrading), executor)
+    pathProfits = np.array([pathProfit for profit, pathProfit in results]).reshape(len(months), StressPaths)
+    table = pd.DataFrame([{"year": year, "month": month, "profit": profit, **StressStats(pathProfit)}
+                          for (year, month), (profit, pathProfit) in zip(months, results)])
+
+    return table, StressStats(pathProfits.sum(axis=0)), pathProfits
+
+def CapacityMonth(year, month, orderSizes, spread, longMax, shortMax, TradeType, deltaTrading):
+    #Trades, contracts, premium and profit in one month for each of orderSizes, solving the month's implied vols once
+    if TradeType not in ("Historical", "Implied", "Surface"):
+        raise ValueError("Invalid TradeType. Must be 'Historical', 'Implied' or 'Surface'.")
+    monthData = SweepMonthData(year, month)
+    volatility = monthData[TradeType]
+    MyBidPrice, MyAskPrice = ColumnQuotes(monthData["columns"], volatility, spread)
+    rows = []
+    for orderSize in orderSizes:
+        ledger = PlaceOrders(monthData["columns"], volatility, MyBidPrice, MyAskPrice, longMax, shortMax, orderSize)
+        profit, MoneyMakers, MoneyLosers = LedgerProfit(ledger, year, month, TradeType != "Historical" and deltaTrading == True)
+        rows.append((orderSize, len(ledger), ledger["size"].sum(), (ledger["price"] * ledger["size"]).sum(), profit))
+
+    return rows
+
+def Capacity(orderSizes, months, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading, executor=None):
+    #How the signal's profit holds up taking more of each quote's displayed size, up to each of orderSizes contracts a quote
+    #Fills are FillModel "Depth" at every size, and the position limits still apply, so longPositionMax and shortPositionMax
+    #(in contracts) need to be big enough not to be the thing that binds
+    monthRows = MapMonths(CapacityMonth, months, (tuple(orderSizes), spread, longPositionMax, shortPositionMax, TradeType, deltaTrading), executor)
+    rows = [(year, month, *row) for (year, month), monthRow in zip(months, monthRows) for row in monthRow]
+    frame = pd.DataFrame(rows, columns=["year", "month", "orderSize", "trades", "contracts", "premium", "profit"])
+    #NaN where nothing filled rather than inf, so means over the table skip those rows
+    frame["profitPerContract"] = frame["profit"].where(frame["contracts"] > 0) / frame["contracts"]
+
+    return frame
+
+def QuoteChunks(inputYear, inputMonth, names):
+    #A month's quotes ReplayChunk rows at a time as a dict of arrays, never holding more than one chunk of the file in memory
+    #Columnar reads slices of the memory mapped columns, CSV streams the formatted file
+    if DatasetFormat == "Columnar":
+        folder = ColumnarDataPath(inputYear, inputMonth)
+        if ColumnarDataStale(inputYear, inputMonth):
+            ConvertOptionData(inputYear, inputMonth)
+        columns = {name: np.load(os.path.join(folder, f"{name}.npy"), mmap_mode="r") for name in names}
+        categories = {name: np.load(os.path.join(folder, f"{name}-categories.npy")) for name in names if OptionColumnTypes.get(name) == "category"}
+        for start in range(0, len(columns["timestamp"]), ReplayChunk):
+            yield {name: categories[name][column[start:start + ReplayChunk]] if name in categories else np.asarray(column[start:start + ReplayChunk])
+                   for name, column in columns.items()}
+    elif DatasetFormat == "CSV":
+        usecols = [name for name in names if name in OptionColumnTypes]
+        if ("expirationDay" in names or "yearFraction" in names) and "expiration" not in usecols:
+            usecols.append("expiration")
+        for chunk in pd.read_csv(OptionDataPath(inputYear, inputMonth), usecols=usecols, chunksize=ReplayChunk):
+            columns = OptionCSVColumns(chunk)
+            yield {name: columns[name + "-categories"][columns[name]] if OptionColumnTypes.get(name) == "category" else columns[name] for name in names}
+    else:
+        raise ValueError("Invalid DatasetFormat. Must be 'CSV' or 'Columnar'.")
+
+def MonthStartMs(inputYear, inputMonth):
+    #Midnight UTC at the start of the month in epoch milliseconds
+    return pd.Timestamp(f"{inputYear}-{inputMonth}-01").value // 10**6
+
+def FirstQuoteTime(inputYear, inputMonth):
+    #Time of the month file's first quote in epoch milliseconds, None if it has none
+    #Files start with whatever was stamped just before midnight on the day before, so this can be before MonthStartMs
+    if DatasetFormat == "Columnar":
+        if ColumnarDataStale(inputYear, inputMonth):
+            ConvertOptionData(inputYear, inputMonth)
+        times = np.load(os.path.join(ColumnarDataPath(inputYear, inputMonth), "timestamp.npy"), mmap_mode="r")
+    else:
+        times = OptionCSVColumns(pd.read_csv(OptionDataPath(inputYear, inputMonth), usecols=["timestamp"], nrows=1))["timestamp"]
+    return int(times[0]) // 1000 if len(times) > 0 else None
+
+def QuoteBlocks(inputYear, inputMonth, names):
+    #A month's quotes a chunk at a time as Replay blocks of (times ms, columns), the names' columns plus "year" and "month",
+    #so a callback knows which month's file a quote came from
+    for chunk in QuoteChunks(inputYear, inputMonth, names):
+        times = chunk["timestamp"] // 1000
+        yield times, {**chunk, "year": np.full(len(times), inputYear), "month": np.full(len(times), inputMonth)}
+
+def BarBlocks(months, timeframe):
+    #Bars over every (year, month) in months as blocks of ReplayChunk bars of (close times ms, Open, High, Low and Close columns), a bar only once it has closed
+    #Each run of up to a year of consecutive months is fetched in one go, starting the day before like MonthBars,
+    #so bars already given for the run before are skipped
+    runs = []
+    for year, month in months:
+        start = pd.Timestamp(f"{year}-{month}-01")
+        if runs and runs[-1][1] == start and runs[-1][2] < 12:
+            runs[-1][1:] = [start + pd.offsets.MonthBegin(), runs[-1][2] + 1]
+        else:
+            runs.append([start, start + pd.offsets.MonthBegin(), 1])
+    last = None
+    for start, end, runMonths in runs:
+        bars = FetchData("BTC/USDT", timeframe, ((end - start).days + 1) * TimeframeMs("1d") // TimeframeMs(timeframe), (start - timedelta(days=1)).strftime("%Y-%m-%d"))
+        closeTimes = BarTimes(bars) + TimeframeMs(timeframe)
+        keep = closeTimes > last if last is not None else np.ones(len(closeTimes), dtype=bool)
+        if keep.any():
+            last = closeTimes[keep][-1]
+        closeTimes = closeTimes[keep]
+        columns = {name: bars[name].to_numpy(dtype=float)[keep] for name in ("Open", "High", "Low", "Close")}
+        for first in range(0, len(closeTimes), ReplayChunk):
+            yield closeTimes[first:first + ReplayChunk], {name: column[first:first + ReplayChunk] for name, column in columns.items()}
+
+def MonthBlocks(months, firstQuotes):
+    #The start of every (year, month) in months as one block of times with "year" and "month" columns, in time order
+    #A month starts at its first quote in firstQuotes if that comes before midnight, so every quote of its file comes after its EventMonth
+    times = []
+    for year, month in months:
+        monthStart = MonthStartMs(year, month)
+        firstQuote = firstQuotes[(year, month)]
+        times.append(monthStart if firstQuote is None else min(monthStart, firstQuote))
+    times = np.array(times, dtype=np.int64)
+    order = np.argsort(times, kind="stable")
+    yield times[order], {"year": np.array([year for year, month in months])[order], "month": np.array([month for year, month in months])[order]}
+
+def ExpiryBlocks(months):
+    #The close of every day of every (year, month) in months as one block of times with "year", "month" and "day" columns,
+    #day counted from 0 like expirationDay, in time order
+    days = [(year, month, day) for year, month in months for day in range(pd.Timestamp(f"{year}-{month}-01").days_in_month)]
+    monthStarts = {(year, month): MonthStartMs(year, month) for year, month in months}
+    times = np.array([monthStarts[(year, month)] + (day + 1) * TimeframeMs("1d") for year, month, day in days], dtype=np.int64)
+    order = np.argsort(times, kind="stable")
+    yield times[order], {name: np.array([day[n] for day in days])[order] for n, name in enumerate(("year", "month", "day"))}
+
+class ReplayBlock(dict):
+    #A MergeBlocks round's columns of one kind of event by name, each column only turned into a list the first time it's read
+    #so a callback pays for the columns it uses and nothing is made per event, the arrays themselves are in arrays
+    def __init__(self, arrays):
+        super().__init__()
+        self.arrays = arrays
+
+    def __missing__(self, name):
+        column = self[name] = self.arrays[name].tolist()
+        return column
+
+def MergeBlocks(sources):
+    #Merges time ordered sources of blocks into rounds of events in time order, events at the same time in kind order and then by source
+    #sources are (start, kind, blocks) triples, every event of a source being of its kind and blocks giving (times ms, columns)
+    #with columns a dict of arrays as long as times, a source isn't read until the merge gets to its start time, None to read it straight away
+    #Each round is (times, kinds, rows, columns) with columns[kind] the round's columns of that kind as a ReplayBlock, event i being row rows[i] of columns[kinds[i]]
+    #Each round sorts together everything before the earliest point any source could still have events from,
+    #a block at a time rather than an event at a time and never as a tuple per event, so the merge costs next to nothing per event
+    waiting = sorted((start, n) for n, (start, kind, blocks) in enumerate(sources) if start is not None)
+    buffers = {}
+    done = set()
+
+    def Pull(n):
+        #adds source n's next non empty block to its buffer, or marks it done
+        for times, columns in sources[n][2]:
+            if len(times) > 0:
+                if n in buffers:
+                    times, columns = np.concatenate([buffers[n][0], times]), {name: np.concatenate([buffers[n][1][name], column]) for name, column in columns.items()}
+                buffers[n] = (times, columns)
+                return
+        done.add(n)
+
+    for n, (start, kind, blocks) in enumerate(sources):
+        if start is None:
+            Pull(n)
+    while buffers or waiting:
+        #no source can have anything before the end of its buffer, unless it's done, or a waiting source before its start
+        cutoff = min([buffer[0][-1] for n, buffer in buffers.items() if n not in done] + [start for start, n in waiting[:1]], default=None)
+        if cutoff is None:
+            taken = {n: len(buffer[0]) for n, buffer in buffers.items()}
+        else:
+            taken = {n: int(np.searchsorted(buffer[0], cutoff)) for n, buffer in buffers.items()}
+            if not any(taken.values()):
+                #everything left is at the cutoff or after it, so read further into whatever set it
+                if waiting and waiting[0][0] == cutoff:
+                    Pull(waiting.pop(0)[1])
+                else:
+                    Pull(next(n for n, buffer in buffers.items() if n not in done and buffer[0][-1] == cutoff))
+                continue
+        parts = sorted((n, last) for n, last in taken.items() if last > 0)
+        times = np.concatenate([buffers[n][0][:last] for n, last in parts])
+        kinds = np.concatenate([np.full(last, sources[n][1], dtype=np.int8) for n, last in parts])
+        #each source's rows carry on from the rows of the sources of its kind before it
+        sizes = {}
+        rows = []
+        for n, last in parts:
+            kind = sources[n][1]
+            rows.append(np.arange(sizes.get(kind, 0), sizes.get(kind, 0) + last))
+            sizes[kind] = sizes.get(kind, 0) + last
+        rows = np.concatenate(rows)
+        columns = {kind: ReplayBlock({name: np.concatenate([buffers[n][1][name][:last] for n, last in parts if sources[n][1] == kind])
+                                      for name in buffers[next(n for n, last in parts if sources[n][1] == kind)][1]}) for kind in sizes}
+        for n, last in parts:
+            if last < len(buffers[n][0]):
+                buffers[n] = (buffers[n][0][last:], {name: column[last:] for name, column in buffers[n][1].items()})
+            else:
+                del buffers[n]
+                if n not in done:
+                    Pull(n)
+        #lexsort is stable, so ties stay in source order and each source's own order
+        order = np.lexsort((kinds, times))
+        yield times[order].tolist(), kinds[order].tolist(), rows[order].tolist(), columns
+
+def ReplayEvents(months, timeframe="5m", names=None):
+    #The events Replay hands out, as MergeBlocks rounds of (times ms, kinds, rows, columns) in time order
+    #Each month's quotes are only read once the replay reaches its first quote, so only the months in play are open at once
+    names = ReplayColumns if names is None else names
+    firstQuotes = {(year, month): FirstQuoteTime(year, month) for year, month in months}
+    sources = [(None, EventBar, BarBlocks(months, timeframe)), (None, EventExpiry, ExpiryBlocks(months)), (None, EventMonth, MonthBlocks(months, firstQuotes))]
+    for year, month in months:
+        if firstQuotes[(year, month)] is not None:
+            sources.append((firstQuotes[(year, month)], EventQuote, QuoteBlocks(year, month, names)))
+    return MergeBlocks(sources)
+
+def Replay(months, callbacks, timeframe="5m", names=None):
+    #Streams bars, month starts, expiry day closes and quotes for every (year, month) in months through callbacks in time order
+    #Every source is read a block at a time and MergeBlocks interleaves them, so memory stays the same whatever the span
+    #callbacks maps an event kind (EventBar etc.) to a function of (time ms, columns, row), the event being row row of columns,
+    #a dict of lists by name, so no event is ever made into a tuple. Kinds with no callback are skipped
+    #Returns how many events went by
+    handlers = [callbacks.get(kind) for kind in (EventBar, EventExpiry, EventMonth, EventQuote)]
+    events = 0
+    for times, kinds, rows, columns in ReplayEvents(months, timeframe, names):
+        events += len(times)
+        blocks = [columns.get(kind) for kind in (EventBar, EventExpiry, EventMonth, EventQuote)]
+        for time, kind, row in zip(times, kinds, rows):
+            handler = handlers[kind]
+            if handler is not None:
+                handler(time, blocks[kind], row)
+
+    return events
+
+def ImpliedVolReplayStrategy(spread, longMax, shortMax):
+    #ImpliedVolTrading's decisions as Replay callbacks, a quote at a time priced off the close of the last bar before it
+    #Each month is traded on its own like ImpliedVolTrading, with its own hist vol, vol state, positions and open trades in state["months"],
+    #so a month's quotes stamped before midnight never mix with the month before's, whose last expiries haven't settled yet
+    #Each expiry is settled at the close of its expiry day as it happens and a month is dropped once its last day has, nothing is delta hedged
+    #Returns the callbacks and the state they keep, where "trades" are the ledger rows and "profit" the settled P&L so far
+    state = {"spot": np.nan, "months": {}, "trades": [], "profit": 0.0}
+
+    def OnBar(time, bars, n):
+        state["spot"] = bars["Close"][n]
+
+    def OnMonth(time, months, n):
+        #every month starts flat with a fresh vol state and the month before's hist vol, like a month of ImpliedVolTrading
+        yearMonth = (months["year"][n], months["month"][n])
+        yearStamp, preMonthStamp = MonthStamps(*yearMonth)
+        dayVolData = FetchData("BTC/USDT", "1d", 30, preMonthStamp)
+        state["months"][yearMonth] = {"HistVol": HistoricalVolCalc(dayVolData["Close"], dayVolData["Timestamp"]), "volState": {},
+                                      "positions": {"call": 0, "put": 0}, "open": {}, "monthStart": MonthStartMs(*yearMonth),
+                                      "days": pd.Timestamp(yearStamp).days_in_month}
+
+    def OnQuote(time, quotes, n):
+        month = state["months"].get((quotes["year"][n], quotes["month"][n]))
+        CallorPut, strike, expirationDay, expiration = quotes["type"][n], quotes["strike_price"][n], quotes["expirationDay"][n], quotes["yearFraction"][n]
+        spot = state["spot"]
+        marketBidPrice = quotes["bid_price"][n] * spot
+        marketAskPrice = quotes["ask_price"][n] * spot
+        if month is None or expiration < 0.0028 or math.isnan(marketBidPrice) or math.isnan(marketAskPrice) or CallorPut not in month["positions"]:
+            return
+        iDelta, iBidIV, iAskIV, iMarkIV = quotes["delta"][n], quotes["bid_iv"][n], quotes["ask_iv"][n], quotes["mark_iv"][n]
+        AskimpliedVol = ImpliedVolatilityFromSource(marketAskPrice, iAskIV, iMarkIV, spot, strike, expiration, month["HistVol"], RFR, CallorPut)
+        BidimpliedVol = ImpliedVolatilityFromSource(marketBidPrice, iBidIV, iMarkIV, spot, strike, expiration, month["HistVol"], RFR, CallorPut)
+        if AskimpliedVol == "Error" or BidimpliedVol == "Error":
+            return
+        volatility = UpdateVolState(month["volState"], expirationDay, strike, (AskimpliedVol + BidimpliedVol)/2, month["HistVol"], time)
+        MyBidPrice, MyAskPrice = BidAsk(spot, strike, expiration, volatility, RFR, CallorPut, spread)
+
+        position = month["positions"][CallorPut]
+        if marketBidPrice > MyAskPrice and position > -shortMax:
+            trade = (time, CallorPut == "call", -1, 1.0, expirationDay, strike, marketBidPrice, iDelta, 100*BidimpliedVol, volatility, 0.0, 0.0, 0.0)
+        elif marketAskPrice < MyBidPrice and position < longMax:
+            trade = (time, CallorPut == "call", 1, 1.0, expirationDay, strike, marketAskPrice, iDelta, 100*AskimpliedVol, volatility, 0.0, 0.0, 0.0)
+        else:
+            return
+        month["positions"][CallorPut] += trade[2]
+        month["open"].setdefault(expirationDay, []).append(len(state["trades"]))
+        state["trades"].append(trade)
+
+    def OnExpiry(time, expiries, n):
+        #the bar closing the expiry day has just come in, so spot is that day's close
+        year, month, day = expiries["year"][n], expiries["month"][n], expiries["day"][n]
+        monthState = state["months"].get((year, month))
+        if monthState is None:
+            return
+        for n in monthState["open"].pop(day, []):
+            trade = list(state["trades"][n])
+            payoff = max(state["spot"] - trade[5], 0) if trade[1] else max(trade[5] - state["spot"], 0)
+            trade[12] = (payoff - trade[6]) * trade[2] * trade[3]
+            state["profit"] += trade[12]
+            state["trades"][n] = tuple(trade)
+        if day == monthState["days"] - 1:
+            del state["months"][(year, month)]
+
+    return {EventBar: OnBar, EventMonth: OnMonth, EventQuote: OnQuote, EventExpiry: OnExpiry}, state
+
+def ImpliedVolReplay(months, spread, longMax, shortMax):
+    #ImpliedVolReplayStrategy over months as one stream, returns the settled profit and the trades as a ledger
+    callbacks, state = ImpliedVolReplayStrategy(spread, longMax, shortMax)
+    Replay(months, callbacks)
+    return state["profit"], np.array(state["trades"], dtype=TradeLedgerType)
+
+def ReplayCheck(months, spread, longMax, shortMax):
+    #Whether ImpliedVolReplay over months places and settles the same trades as ImpliedVolTrading month by month without hedging
+    #They only can with SpotSource = "AsOf", the last bar closed before each quote being all the replay knows
+    #Either IVSolver works, the replay solves each quote with ImpliedVolatilityQuote which lands on the same vols as SolveImpliedVols
+    #Returns the replay's and the batch's profit and trade count and whether the ledgers agree, sorted the same way
+    profit, ledger = ImpliedVolReplay(months, spread, longMax, shortMax)
+    batchProfit = 0
+    batchLedgers = []
+    for year, month in months:
+        monthProfit, MoneyMakers, MoneyLosers, volDataByExpiry = ImpliedVolTrading(year, month, spread, longMax, shortMax, False)
+        batchProfit += monthProfit
+        batchLedgers += [MoneyMakers, MoneyLosers]
+    batch = np.concatenate(batchLedgers) if batchLedgers else np.empty(0, dtype=TradeLedgerType)
+    fields = ("time", "isCall", "side", "size", "expirationDay", "strike", "price", "delta", "marketVol", "myVol", "profit")
+    order = lambda rows: np.lexsort(tuple(rows[name] for name in reversed(fields[:7])))
+    matched = len(ledger) == len(batch) and all(np.allclose(ledger[name][order(ledger)], batch[name][order(batch)], rtol=1e-9, atol=1e-9) for name in fields)
+
+    return {"replayProfit": profit, "batchProfit": batchProfit, "replayTrades": len(ledger), "batchTrades": len(batch), "matched": matched}
+
+def LiveHedging(callbacks, state):
+    #Adds delta hedging to a strategy's Replay callbacks, rebalancing every HedgeFrequency bar and as each expiry comes off
+    #"band" checks every bar and only trades once the hedge is more than HedgeBand away, HedgeVol picks the vol like HedgeLedger
+    #LiveHedgeExpiry "Backtest" works deltas out at expirationDay days to expiry like HedgeLedger and MakeDeltaNeutral, "Decay" at the days left as of each rebalance
+    #The hedge in BTC is kept in state["hedge"] and the cash it has made in state["hedgeCash"]
+    state.update(hedge=0.0, hedgeCash=0.0)
+    every = TimeframeMs("5m" if HedgeFrequency == "band" else HedgeFrequency)
+    OnBar, OnExpiry = callbacks[EventBar], callbacks[EventExpiry]
+
+    def Rebalance(time, force):
+        #every open trade of every month in play, with the time its month started
+        live = [(state["trades"][n], month["monthStart"]) for month in state["months"].values() for expiry in month["open"].values() for n in expiry]
+        target = 0.0
+        if live:
+            positions = LedgerPositions(np.array([trade for trade, monthStart in live], dtype=TradeLedgerType))
+            if LiveHedgeExpiry == "Backtest":
+                daysLeft = positions["expiryDay"]
+            elif LiveHedgeExpiry == "Decay":
+                daysGone = (time - np.array([monthStart for trade, monthStart in live])) / TimeframeMs("1d")
+                daysLeft = np.maximum(positions["expiryDay"] - daysGone, 0)
+            else:
+                raise ValueError("Invalid LiveHedgeExpiry. Must be 'Backtest' or 'Decay'.")
+            target = -float((positions["sign"] * DeltaColumns(positions["isCall"], state["spot"], positions["strike"], daysLeft, RFR, positions["vol"])).sum())
+        move = target - state["hedge"]
+        if HedgeFrequency == "band" and not force and abs(move) <= HedgeBand:
+            return
+        state["hedgeCash"] -= move * state["spot"]
+        state["hedge"] = target
+
+    def OnHedgeBar(time, bars, n):
+        #months start at midnight UTC, so HedgeFrequency bars line up with the times from each month's start
+        OnBar(time, bars, n)
+        if state["months"] and time % every == 0:
+            Rebalance(time, False)
+
+    def OnHedgeExpiry(time, expiries, n):
+        OnExpiry(time, expiries, n)
+        Rebalance(time, True)
+
+    return {**callbacks, EventBar: OnHedgeBar, EventExpiry: OnHedgeExpiry}
+
+async def FeedServer(months, host=None, port=None, speed=None):
+    #A stand in for a live feed, serving Replay's events for months to every client that connects as JSON lines [time ms, kind, columns],
+    #columns being the event as a one row block, each of its kind's columns by name as a list of its one value
+    #speed is how many times faster than real time the events go out, 0 as fast as the client takes them
+    #Returns the started asyncio server, run it with "async with server: await server.serve_forever()"
+    speed = FeedSpeed if speed is None else speed
+
+    async def Serve(reader, writer):
+        loop = asyncio.get_running_loop()
+        start = firstTime = None
+        n = 0
+        for times, kinds, rows, columns in ReplayEvents(months):
+            for time, kind, row in zip(times, kinds, rows):
+                if speed:
+                    if start is None:
+                        start, firstTime = loop.time(), time
+                    wait = start + (time - firstTime) / (1000 * speed) - loop.time()
+                    if wait > 0.001:
+                        await writer.drain()
+                        await asyncio.sleep(wait)
+                block = columns[kind]
+                writer.write(json.dumps([time, kind, {name: [block[name][row]] for name in block.arrays}]).encode() + b"\n")
+                n += 1
+                if n % 1024 == 0:
+                    await writer.drain()
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    return await asyncio.start_server(Serve, FeedHost if host is None else host, FeedPort if port is None else port)
+
+async def PaperTrader(spread, longMax, shortMax, deltaTrading, host=None, port=None):
+    #Trades the implied vol strategy off a feed like FeedServer's as it comes in, hedging too if deltaTrading
+    #Quotes are solved with IVSolver through ImpliedVolReplayStrategy, so live and backtest trades come from the same vols
+    #Keeps ImpliedVolReplayStrategy's state and adds "quotes", "events" and "latency", each quote's time from the line arriving to its decision in microseconds
+    callbacks, state = ImpliedVolReplayStrategy(spread, longMax, shortMax)
+    if deltaTrading:
+        callbacks = LiveHedging(callbacks, state)
+    handlers = [callbacks.get(kind) for kind in (EventBar, EventExpiry, EventMonth, EventQuote)]
+    latency = []
+    reader, writer = await asyncio.open_connection(FeedHost if host is None else host, FeedPort if port is None else port)
+    events = 0
+    async for line in reader:
+        received = perf_counter_ns()
+        time, kind, columns = json.loads(line)
+        handler = handlers[kind]
+        if handler is not None:
+            handler(time, columns, 0)
+        if kind == EventQuote:
+            latency.append(perf_counter_ns() - received)
+        events += 1
+    writer.close()
+    await writer.wait_closed()
+    state.update(events=events, quotes=len(latency), latency=np.array(latency) / 1000)
+
+    return state
+
+async def PaperTradingSession(months, spread, longMax, shortMax, deltaTrading, speed=None):
+    #Serves months from a local FeedServer and paper trades them with PaperTrader, for trying the live loop offline
+    #Returns the trader's state and a summary of profit, hedging, trades and decision latency
+    server = await FeedServer(months, speed=speed)
+    async with server:
+        state = await PaperTrader(spread, longMax, shortMax, deltaTrading, port=server.sockets[0].getsockname()[1])
+    hedgeProfit = state.get("hedgeCash", 0.0) + state.get("hedge", 0.0) * state["spot"]
+    summary = {"profit": state["profit"] + hedgeProfit, "optionProfit": state["profit"], "hedgeProfit": hedgeProfit, "trades": len(state["trades"]),
+               "events": state["events"], "quotes": state["quotes"]}
+    if state["quotes"]:
+        summary.update(latencyMedian=float(np.median(state["latency"])), latency99=float(np.percentile(state["latency"], 99)), latencyMax=float(state["latency"].max()))
+
+    return state, summary
+
+def BacktestMonths(inputYear, inputMonth):
+    #The (year, month) pairs there's option data for, the data starts in April 2019
+    return [(year, month) for year in inputYear for month in inputMonth if not ((year == "2019" and int(month) < 4) or int(month) > 12)]
+
+def ProfitData(spread, longPositionMax, shortPositionMax, TradeType, deltaTrading, executor=None, monthProfits=None):
+    #monthProfits is each (year, month)'s profit if the months have already been run, e.g. by EquityCurve, so they aren't run again
     inputYear = ["2019", "2020", "2021", "2022", "2023"]#add 2022 and 2023 soon EDIT HERE IF TAKING TOO LONG
     inputMonth = ["01","02","03","04","05","06","07","08","09","10","11","12"]
 
@@ -687,25 +2608,19 @@ def ProfitData(spread, longPositionMax, shortPositionMax, TradeType, deltaTradin
     profit_2022 = 0
     profit_2023 = 0
 
+    months = BacktestMonths(inputYear, inputMonth)
+    if monthProfits is None:
+        monthProfits = dict(zip(months, RunMonths(months, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading, executor)))
+
     for year in inputYear:
         if year not in profit_table:
             profit_table[year] = {}
 
         for month in inputMonth:
-            if (year == "2019" and int(month) < 4) or int(month) > 12:
+            if (year, month) not in monthProfits:
                 continue
-            
-            if TradeType == "Historical":
-                profit, MoneyMakers, MoneyLosers = HistoricalVolTrading(year, month, spread, longPositionMax, shortPositionMax)
-            elif TradeType == "Implied":
-                profit, MoneyMakers, MoneyLosers, _ = ImpliedVolTrading(year, month, spread, longPositionMax, shortPositionMax, deltaTrading)
-            elif TradeType == "DeltaNeutral":
-                #fill
-                pass
-            else:
-                print("Error in Trade type.")
-
 
+            profit = monthProfits[(year, month)]
             profit = "{:.2f}".format(profit)
             profit = float(profit)
             profit_table[year][month] = profit
@@ -752,10 +2667,8 @@ def ProfitData(spread, longPositionMax, shortPositionMax, TradeType, deltaTradin
 
 
 def MonthProfitGraph(inputYearChoice, inputMonthChoice, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading):
-    if TradeType == "Historical":
-        profit, MoneyMakers, MoneyLosers = HistoricalVolTrading(inputYearChoice, inputMonthChoice, spread, longPositionMax, shortPositionMax)
-    elif TradeType == "Implied":
-        profit, MoneyMakers, MoneyLosers, volDataByExpiry = ImpliedVolTrading(inputYearChoice, inputMonthChoice, spread, longPositionMax, shortPositionMax, deltaTrading)
+    if TradeType == "Historical" or TradeType == "Implied" or TradeType == "Surface":
+        profit, MoneyMakers, MoneyLosers, volDataByExpiry = MonthTrading(inputYearChoice, inputMonthChoice, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading)
     elif TradeType == "DeltaNeutral":
         #fill
         pass
@@ -766,20 +2679,17 @@ def MonthProfitGraph(inputYearChoice, inputMonthChoice, spread, longPositionMax,
     yearStamp = f"{inputYearChoice}-{inputMonthChoice}-01"
     print("This months profit was: ", profit)
 
-    #MoneyMakers = [Call or put, expiration, strike, premium, delta, market vol, my vol, Buy or Sell, Profit]
-    #MoneyLosers = [Call or put, expiration, strike, premium, delta, market vol, my vol, Buy or Sell, Profit]
+    #MoneyMakers and MoneyLosers are trade ledgers, see TradeLedgerType for the columns
 
 
     #PLOTS
     #---------------------------------------------------------------------------------------------------------------
 
-    all_data = MoneyMakers + MoneyLosers
+    all_data = np.concatenate([MoneyMakers, MoneyLosers])
     print("Number of trades: ", len(all_data))
 
-    if deltaTrading == True:
-        for entry in all_data:
-            entry.append(entry[8]+entry[9])
-    
+    #option profit plus any hedge cash, which is 0 without deltaTrading
+    total = all_data["profit"] + all_data["hedgeCash"]
     
 
     fig, ax = plt.subplots()
@@ -793,16 +2703,11 @@ def MonthProfitGraph(inputYearChoice, inputMonthChoice, spread, longPositionMax,
         plt.plot(vol_x, vol_y, 'o-', color='blue', label='Volatility Level')
 
         # Plotting trade data
-        for trade in all_data:
-            trade_x = trade[1]  # day of month
-            trade_y = trade[5]  # market volatility level
-            
-            size = abs(trade[-1])  # Absolute value of Profit
-            color = 'green' if trade[-1] >= 0 else 'red'  # Green for positive Profit, red for negative
-        
-            # Determine marker style based on the entry type
-            marker = 'o' if trade[7] == 'Buy' else 's'
-            plt.scatter(trade_x, trade_y,s=size, edgecolors=color, facecolors="none", marker=marker)
+        for side, marker in ((1, 'o'), (-1, 's')):
+            trades = all_data["side"] == side
+            # day of month against market volatility level, sized by profit, green for positive Profit, red for negative
+            plt.scatter(all_data["expirationDay"][trades], all_data["marketVol"][trades], s=np.abs(total[trades]),
+                        edgecolors=np.where(total[trades] >= 0, 'green', 'red'), facecolors="none", marker=marker)
 
         # Adding labels and title
         plt.xlabel('Day of Month')
@@ -825,16 +2730,11 @@ def MonthProfitGraph(inputYearChoice, inputMonthChoice, spread, longPositionMax,
 
     # Plotting different markers for 'Buy' and 'Sell' entries
     else:
-        for item in all_data:
-            delta = item[4]  # Delta
-            y = item[5]  # Market vol
-            size = abs(item[-1])  # Absolute value of Profit
-            color = 'green' if item[-1] >= 0 else 'red'  # Green for positive Profit, red for negative
-            
-            # Determine marker style based on the entry type
-            marker = 'o' if item[7] == 'Buy' else 's'  # Circle for 'Buy', square for 'Sell'
-            
-            ax.scatter(delta, y, s=size, edgecolors=color, facecolors='none', marker=marker)
+        for side, marker in ((1, 'o'), (-1, 's')):
+            trades = all_data["side"] == side
+            # Delta against market vol, circle for 'Buy', square for 'Sell', green for positive Profit, red for negative
+            ax.scatter(all_data["delta"][trades], all_data["marketVol"][trades], s=np.abs(total[trades]),
+                       edgecolors=np.where(total[trades] >= 0, 'green', 'red'), facecolors='none', marker=marker)
 
         # Create a custom legend
         legend_elements = [Line2D([0], [0], marker='o', color='w', markerfacecolor='none', markeredgecolor='black', markersize=10, label='Buy'),
@@ -843,11 +2743,12 @@ def MonthProfitGraph(inputYearChoice, inputMonthChoice, spread, longPositionMax,
         # Add legend
         ax.legend(handles=legend_elements)
 
-        # Extract your volatility from the first entry of MoneyMakers
-        your_volatility = MoneyMakers[0][-3]*100
+        # Extract your volatility from the first entry of MoneyMakers, a month with no winning trades has none to mark
+        if len(MoneyMakers) > 0:
+            your_volatility = MoneyMakers["myVol"][0]*100
 
-        # Add a straight line parallel to the x-axis marking your volatility in blue
-        ax.axhline(your_volatility, color='blue', linestyle='--', label='Your Volatility')
+            # Add a straight line parallel to the x-axis marking your volatility in blue
+            ax.axhline(your_volatility, color='blue', linestyle='--', label='Your Volatility')
 
         # Set labels and title
         ax.set_xlabel('Delta')
@@ -856,7 +2757,7 @@ def MonthProfitGraph(inputYearChoice, inputMonthChoice, spread, longPositionMax,
 
 
     #FETCH DATA
-    btc_data = FetchData("BTC/USDT", "2h", 360, yearStamp)
+    btc_data = MonthBars(yearStamp, "2h")
 
     # Plot Crypto Prices and Options
     fig, ax = plt.subplots()
@@ -868,10 +2769,10 @@ def MonthProfitGraph(inputYearChoice, inputMonthChoice, spread, longPositionMax,
     legend_labels = set()  # Set to store unique legend labels
 
     for item in all_data:
-        option_type = item[0].lower()
-        expiration_days = item[1] 
-        strike_price = item[2]
-        action = item[7].lower()
+        option_type = 'call' if item["isCall"] else 'put'
+        expiration_days = int(item["expirationDay"])
+        strike_price = item["strike"]
+        action = 'buy' if item["side"] == 1 else 'sell'
         color = 'green' if action == 'buy' else 'red'
 
         # Determine marker style based on the combination of option type and action
@@ -931,38 +2832,111 @@ RFR = 0.0242
 longPositionMax = 20
 shortPositionMax = 10
 spread = 0.2
-TradeType = "Implied"
+TradeType = "Implied" #"Implied", "Historical" or "Surface"
 deltaTrading = True
+Engine = "Columnar" #"Columnar" or "Rows" for the original row by row loop
+IVSolver = "Batch" #"Batch" solves a whole month of quotes at once, falling back to bisection up to VolMax, "Newton" solves each quote with scipy's newton on the Black-Scholes kernel (the two can give different trades, and neither gives the original vols exactly, see the README)
+VolMax = 100 #upper bracket for the batch implied vol solver
+IVTolerance = 1e-10
+IVSource = "Solve" #"Solve" solves every bid and ask with IVSolver, "Exchange" takes the dataset's bid_iv/ask_iv with no solving, "Reconcile" takes them unless missing or off by more than IVReconcileTolerance and solves just those
+IVReconcileTolerance = 0.01 #vol the exchange's implied vol can be off the quote's price by before "Reconcile" solves it, 0.01 is one vol point
+BarSource = BinanceSource #FileSource reads bars from CSVs in BarFileDir instead so the backtest runs with no network
+BarFileDir = "datasets/Price bars"
+BarStoreDir = "datasets/Bar store" #bars already fetched are kept here, None to always go to BarSource
+SpotSource = "Bars" #"Bars" 5 minute Binance bars, "Dataset" the underlying_price in the option data, "AsOf" last full bar from the whole month
+DatasetFormat = "Columnar" #"Columnar" reads memory mapped .npy columns from "datasets/Columnar YYYY/MM", "CSV" the formatted CSVs
+Workers = os.cpu_count() #processes ProfitData spreads the months over, 1 runs them one after another
+HedgeFrequency = "1d" #how often MakeDeltaNeutral rebalances, "1d", "4h", "1h", "5m", or "band" to check every 5 minutes and only trade outside HedgeBand
+HedgeBand = 0.05 #delta the hedge can drift by before "band" rebalances
+HedgeBlock = 256 #positions hedged at a time, bounds the memory the intraday hedging uses
+HedgeVol = "Model" #"Model" hedges at the vol we priced with, "Market" at the implied vol the trade was done at
+VolEstimator = "Mean" #how ImpliedVolTrading updates its vol per expiry, "Mean" running mean, "EWMA" exponentially weighted, "Window" mean of the last VolWindow quotes
+VolDecay = 0.05 #weight "EWMA" gives each new quote
+VolWindow = 50
+VolSeed = "HistVol" #"HistVol" starts each expiry at HistVol times the first market vol, "Market" at the first market vol
+VolStrikeBucket = None #strike width to keep a separate vol per strike bucket within each expiry, None for one per expiry
+HistVolEstimator = "Month" #HistoricalVolTrading's vol, "Month" from the 30 daily closes of the month before, or "CloseToClose", "Parkinson", "GarmanKlass", "YangZhang" rolling as of each quote
+HistVolWindow = 30 #bars in the rolling window
+HistVolWindows = (7, 30, 90) #windows HistoricalVolTable works out alongside HistVolWindow
+HistVolTimeframe = "1d"
+HistVolStart = "2018-10-01" #bar history the rolling vols are built from
+HistVolEnd = "2024-01-01"
+SurfaceBucket = "1h" #width of the chain snapshots TradeType "Surface" fits a smile to, each quote is priced off the last finished one
+SurfaceSmoothing = 1e-4 #ridge on the smile's slope and curvature, larger keeps the smiles flatter
+ResultCacheDir = "datasets/Result cache" #each month's result is kept here keyed by its data, prices and settings, None to always rerun
+ResultCacheSize = 256 * 1024**2 #bytes the result cache can use before the least recently used months are dropped
+PriceVersion = 1 #bump to throw away cached results after changing the price bars
+ReplayChunk = 1 << 16 #quotes Replay reads from a month's file at a time
+FeedHost = "127.0.0.1" #where FeedServer serves and PaperTrader connects
+FeedPort = 8765 #0 lets FeedServer pick a free port
+FeedSpeed = 0 #times faster than real time FeedServer replays, 0 as fast as the trader keeps up
+LiveHedgeExpiry = "Backtest" #days to expiry PaperTrader hedges at, "Backtest" the expirationDay days HedgeLedger uses so the hedge P&L compares, "Decay" the days left at each rebalance
+FillModel = "Unit" #"Unit" fills one contract a quote like the original loop, "Depth" as much of the displayed bid_amount/ask_amount as FillShare and the limits allow
+FillShare = 1.0 #share of a quote's displayed size "Depth" expects to get
+OrderSize = None #most contracts "Depth" takes off one quote, None for no cap
+FillStep = 0.1 #smallest size "Depth" trades in, Deribit's minimum BTC option order
+ExpiryLimit = None #most net contracts held in any one expiry, None for no limit
+ContractLimit = None #most net contracts held in any one option (type, expiry and strike)
+OpenInterestShare = None #most of an option's open interest held at once, e.g. 0.05
+DeltaLimit = None #largest net option delta in BTC either way
+VegaLimit = None #largest net option vega either way, in USD per 1.00 of vol
+EquityTimeframe = "1d" #how often EquityCurve marks open options and hedges to market, "1d", "4h", "1h" or "5m"
+MarkVol = "State" #vol EquityCurve marks options at, "State" the model's vol as of each mark (surface, expiry vol state or rolling hist vol), "Market" the exchange's mark_iv as of each mark, "Trade" the vol each trade was priced at
+RunStressTest = False #True for the run to also stress test every month's trades with StressTest
+StressPaths = 10000 #simulated price paths StressTest settles and hedges each month's trades against
+StressChunk = 1000 #paths simulated at a time, bounds the memory a month takes
+StressModel = "Jump" #"GBM" or "Jump" for GBM with Merton jumps
+StressVol = None #annual vol of the simulated paths, None for the month before's HistVol like the strategy uses
+StressDrift = 0.0 #annual drift of the simulated paths
+JumpIntensity = 12 #jumps a year "Jump" expects
+JumpMean = -0.02 #mean log size of a jump
+JumpVol = 0.08 #standard deviation of a jump's log size
+StressLevel = 0.99 #confidence of the VaR and expected shortfall
+StressSeed = 0 #each month's paths come from this and the month, so reruns give the same paths
 
 #profit, MoneyMakers, MoneyLosers = ImpliedVolTrading("2020", "11", spread, longPositionMax, shortPositionMax, deltaTrading)
 #print(f"The profit without delta stuff was: {profit}")
+#paperState, paperSummary = asyncio.run(PaperTradingSession([("2022", "07")], spread, longPositionMax, shortPositionMax, deltaTrading))
+
+if __name__ == "__main__":
+    #Run the functions
+
+    months = BacktestMonths(["2019", "2020", "2021", "2022", "2023"], ["01","02","03","04","05","06","07","08","09","10","11","12"])
+    #Mark to market equity over the whole backtest, months carrying on from each other, each month's curve ending on its profit for ProfitData
+    equityCurve, monthEquityStats, equityStats = EquityCurve(months, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading)
+    dataTableImplied, profit_list = ProfitData(spread, longPositionMax, shortPositionMax, TradeType, deltaTrading,
+                                               monthProfits=dict(zip(months, monthEquityStats["profit"])))
 
-#Run the functions
+    print(f"data table implied: {dataTableImplied}")
+    #dataTableHist = ProfitData(spread, longPositionMax, shortPositionMax, "Historical", deltaTrading)
+    #print(f"data table historical: {dataTableImplied}")
 
-dataTableImplied, profit_list = ProfitData(spread, longPositionMax, shortPositionMax, TradeType, deltaTrading)
-mean_profit = np.mean(profit_list)
-std_profit = np.std(profit_list)
+    print(tabulate(monthEquityStats.round(2), headers="keys", tablefmt="pretty", showindex=False))
+    print(f"Over the backtest the profit was {equityStats['profit']:.2f}, the max drawdown {equityStats['maxDrawdown']:.2f} and the Sharpe {equityStats['sharpe']:.2f}")
+    print(f"{equityStats['trades']} trades of {equityStats['contracts']:.1f} contracts for {equityStats['optionTurnover']:.2f} in premium, {equityStats['hedgeTurnover']:.2f} traded hedging")
 
-print(f"data table implied: {dataTableImplied}")
-#dataTableHist = ProfitData(spread, longPositionMax, shortPositionMax, "Historical", deltaTrading)
-#print(f"data table historical: {dataTableImplied}")
+    if IVSource != "Solve":
+        print(tabulate(IVReconciliationTable(months).round(4), headers="keys", tablefmt="pretty", showindex=False))
 
-# Create a new table by subtracting values from dataTableHist from dataTableImplied
-print(f"The mean monthly profit was {mean_profit} and the standard deviation was {std_profit}")
-result_table = []
+    if RunStressTest:
+        #Each month's trades against StressPaths simulated price paths
+        stressTable, stressStats, stressProfits = StressTest(months, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading)
+        print(tabulate(stressTable.round(2), headers="keys", tablefmt="pretty", showindex=False))
+        print(f"Over {StressPaths} simulated backtests the mean profit was {stressStats['mean']:.2f}, the {StressLevel:.0%} VaR {stressStats['VaR']:.2f} and expected shortfall {stressStats['expectedShortfall']:.2f}")
+    result_table = []
 
 
 
-# Print the result
+    # Print the result
 
-inputYear = ["2019", "2020", "2021", "2022", "2023"]
-table_headers = ["Month"] + inputYear
-formatted_table = tabulate(result_table, headers=table_headers, tablefmt="pretty")
-print(formatted_table)
+    inputYear = ["2019", "2020", "2021", "2022", "2023"]
+    table_headers = ["Month"] + inputYear
+    formatted_table = tabulate(result_table, headers=table_headers, tablefmt="pretty")
+    print(formatted_table)
 
-inputYearChoice = "2022"
-inputMonthChoice = "07" 
-MonthProfitGraph(inputYearChoice, inputMonthChoice, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading)
+    inputYearChoice = "2022"
+    inputMonthChoice = "07" 
+    MonthProfitGraph(inputYearChoice, inputMonthChoice, spread, longPositionMax, shortPositionMax, TradeType, deltaTrading)
 
 
 
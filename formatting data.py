@@ -1,66 +1,103 @@
-import ccxt
-from datetime import datetime, timedelta
+import os
+import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy.stats import norm
-binance = ccxt.binance()
-#Read in actual option prices
-
-file_path_ind = ["datasets/2023/deribit_options_chain_2023-01-01_OPTIONS.csv.gz",
-                 "datasets/2023/deribit_options_chain_2023-02-01_OPTIONS.csv.gz",
-                 "datasets/2023/deribit_options_chain_2023-03-01_OPTIONS.csv.gz",
-                 "datasets/2023/deribit_options_chain_2023-04-01_OPTIONS.csv.gz",
-                 "datasets/2023/deribit_options_chain_2023-05-01_OPTIONS.csv.gz",
-                 "datasets/2023/deribit_options_chain_2023-06-01_OPTIONS.csv.gz",
-                 "datasets/2023/deribit_options_chain_2023-07-01_OPTIONS.csv.gz",
-                 "datasets/2023/deribit_options_chain_2023-08-01_OPTIONS.csv.gz",
-                 "datasets/2023/deribit_options_chain_2023-09-01_OPTIONS.csv.gz",
-                 "datasets/2023/deribit_options_chain_2023-10-01_OPTIONS.csv.gz",
-                 "datasets/2023/deribit_options_chain_2023-11-01_OPTIONS.csv.gz",
-                 "datasets/2023/deribit_options_chain_2023-12-01_OPTIONS.csv.gz"]
+
+#Turns the raw tardis option chain downloads into the backtest datasets
+#Each day file is streamed in chunks, so memory stays bounded however big the chain is,
+#and every month runs in its own process
+#e.g. python "formatting data.py" 2019 2020 2021 2022 2023 --workers 16
 
 month_ind = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
 month_num = ["01", "02", "03", "04", "05", "06", "07", "08", "09", "10", "11", "12"]
+ChunkSize = 500_000
 
-i = 0
-while i < 12:
-    file_path = file_path_ind[i]
-    month = month_ind[i]
-    monthN = month_num[i]
-    new_df = pd.read_csv(file_path, compression= "gzip")
-    btc_df = new_df[new_df['symbol'].str.contains('BTC')]
-    print("Length of bitcoin: ", len(btc_df))
-    monthBtc_df = btc_df[btc_df["symbol"].str.contains(month)]
-    print("Length of month expire: ", len(monthBtc_df))
-    delta_df = monthBtc_df[
-    ((monthBtc_df['delta'] >= 0.5) & (monthBtc_df['delta'] <= 0.6)) |
-    ((monthBtc_df['delta'] <= -0.45) & (monthBtc_df['delta'] >= -0.55))] #updated delta for put options
-    print("Length of ATMs: ", len(delta_df))
-
-    adjusted_df = delta_df.copy()
-    adjusted_df['timestamp'] = pd.to_datetime(adjusted_df['timestamp'], unit='us')
-    # Sort the DataFrame by the 'timestamp' column
-    adjusted_df = adjusted_df.sort_values(by='timestamp')
-    print(adjusted_df[["last_price"]].head())
-    unique_price_df = adjusted_df.drop_duplicates(subset=['bid_price', 'ask_price'], keep='first')
+MainCode = None
+
+
+def LoadMainCode():
+    #the backtest's own columnar writer, so the output is exactly what LoadOptionData reads
+    #loaded once per worker and only when columnar output is asked for, the main script sets up its exchange on import
+    global MainCode
+    if MainCode is None:
+        spec = importlib.util.spec_from_file_location("MainCode", os.path.join(os.path.dirname(os.path.abspath(__file__)), "Historical Vol main code.py"))
+        MainCode = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(MainCode)
+    return MainCode
+
+def RawFilePath(year, month):
+    return f"datasets/{year}/deribit_options_chain_{year}-{month}-01_OPTIONS.csv.gz"
+
+def ParseSymbols(symbols):
+    #Splits symbols like "BTC-10JAN20-7250-P" into underlying, expiry month and strike
+    #Only the distinct symbols are parsed, the chain repeats each one many times
+    codes, uniques = pd.factorize(symbols)
+    parts = pd.Series(uniques).str.split("-", expand=True)
+    underlying = parts[0].to_numpy()
+    expiryMonth = parts[1].str[-5:-2].to_numpy()
+    strike = pd.to_numeric(parts[2], errors="coerce").to_numpy(dtype=float)
+    return underlying[codes], expiryMonth[codes], strike[codes]
 
-    print("Length of Unique price: ", len(unique_price_df))
+def DeltaBand(delta):
+    #ATM calls and puts, updated delta for put options
+    return ((delta >= 0.5) & (delta <= 0.6)) | ((delta <= -0.45) & (delta >= -0.55))
 
-    # Convert 'local_timestamp' and 'expiration' columns from ms to date format
-    unique_price_df_format = unique_price_df.copy()
-    unique_price_df_format['local_timestamp'] = pd.to_datetime(unique_price_df['local_timestamp'], unit='us')
-    unique_price_df_format['expiration'] = pd.to_datetime(unique_price_df['expiration'], unit='us')
+def FilterChunk(chunk, month):
+    #BTC options expiring this month inside the delta band, any strike_price missing from the row taken from its symbol
+    underlying, expiryMonth, strike = ParseSymbols(chunk["symbol"])
+    keep = (underlying == "BTC") & (expiryMonth == month_ind[month_num.index(month)]) & DeltaBand(chunk["delta"].to_numpy())
+    chunk = chunk[keep].copy()
+    chunk["strike_price"] = chunk["strike_price"].fillna(pd.Series(strike[keep], index=chunk.index))
+    return chunk
+
+def FormatMonth(year, month, outputs):
+    #Streams one raw day file, filters it and writes the month out in the formats asked for
+    seen = 0
+    kept = []
+    for chunk in pd.read_csv(RawFilePath(year, month), compression="gzip", chunksize=ChunkSize):
+        seen += len(chunk)
+        kept.append(FilterChunk(chunk, month))
+    adjusted_df = pd.concat(kept, ignore_index=True)
+    print(f"{year}-{month}: {seen} quotes, {len(adjusted_df)} BTC ATMs expiring this month")
+
+    adjusted_df["timestamp"] = pd.to_datetime(adjusted_df["timestamp"], unit="us")
+    # Sort the DataFrame by the 'timestamp' column
+    adjusted_df = adjusted_df.sort_values(by="timestamp", kind="stable")
+    unique_price_df_format = adjusted_df.drop_duplicates(subset=["bid_price", "ask_price"], keep="first").copy()
+    print(f"{year}-{month}: {len(unique_price_df_format)} unique prices")
+
+    # Convert 'local_timestamp' and 'expiration' columns from us to date format
+    unique_price_df_format["local_timestamp"] = pd.to_datetime(unique_price_df_format["local_timestamp"], unit="us")
+    unique_price_df_format["expiration"] = pd.to_datetime(unique_price_df_format["expiration"], unit="us")
 
     #save file
-    save_file = f"datasets/Formatted 2023/{monthN}.csv"
-    unique_price_df_format.to_csv(save_file, index=False)
-    i += 1
-    print("The value of i is now: ", i)
+    if "csv" in outputs:
+        os.makedirs(f"datasets/Formatted {year}", exist_ok=True)
+        unique_price_df_format.to_csv(f"datasets/Formatted {year}/{month}.csv", index=False)
+    if "columnar" in outputs:
+        mainCode = LoadMainCode()
+        mainCode.WriteOptionColumns(mainCode.OptionCSVColumns(unique_price_df_format), mainCode.ColumnarDataPath(year, month))
+
+    return year, month, len(unique_price_df_format)
 
-    
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Format the raw tardis option chains into backtest datasets")
+    parser.add_argument("years", nargs="+")
+    parser.add_argument("--months", nargs="+", default=month_num)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--outputs", nargs="+", default=["columnar", "csv"], choices=["columnar", "csv"])
+    args = parser.parse_args()
 
-print("Job Done")
+    jobs = [(year, month) for year in args.years for month in args.months if os.path.exists(RawFilePath(year, month))]
+    missing = [(year, month) for year in args.years for month in args.months if not os.path.exists(RawFilePath(year, month))]
+    for year, month in missing:
+        print(f"No raw file for {year}-{month}, skipping")
 
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for year, month, rows in pool.map(FormatMonth, [year for year, _ in jobs], [month for _, month in jobs], [args.outputs] * len(jobs)):
+            print(f"Wrote {year}-{month}: {rows} rows")
 
+    print("Job Done")